@@ -0,0 +1,234 @@
+import hashlib
+import json
+import math
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+import bson
+import numpy as np
+from scipy import sparse
+
+import datastore
+from cooccurrence import cooccurrence_matrix
+from graph import PAIR_PARAMS, CooccurrenceGraph
+from metrics import count, timed
+from pipeline import HISTOGRAM_EDGES, AnalysisContext, network_payload
+from result_cache import ANALYSIS_VERSION, CACHE_MAX_BYTES
+
+# Most files (datasets) one aggregate may cover
+AGGREGATE_MAX_FILES = int(os.getenv("AGGREGATE_MAX_FILES", 200))
+# Words kept in each file's term partial, most frequent first
+AGGREGATE_TERMS = int(os.getenv("AGGREGATE_TERMS", 2000))
+# Each file's co-occurrence partial counts pairs among its most frequent words
+AGGREGATE_PAIR_WORDS = int(os.getenv("AGGREGATE_PAIR_WORDS", 100))
+# Bump when the partial format changes
+PARTIAL_VERSION = 1
+
+INTERVALS = ("day", "week", "month")
+# Trend points list this many of each period's most frequent words
+TREND_TERMS = 5
+
+
+def aggregate_params(args):
+    """(interval, start, end) from request args; raises ValueError when invalid."""
+    interval = args.get("interval", "day")
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    bounds = []
+    for name in ("start", "end"):
+        raw = args.get(name)
+        try:
+            bound = datetime.fromisoformat(raw) if raw else None
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO date such as 2024-01-31")
+        if bound is not None and bound.tzinfo is not None:
+            # Upload times come back from MongoDB as naive UTC
+            bound = bound.astimezone(timezone.utc).replace(tzinfo=None)
+        bounds.append(bound)
+    return interval, *bounds
+
+
+def partial_key_params(params):
+    """The options a file's partial depends on."""
+    return {"aggregate_partial": PARTIAL_VERSION,
+            **{k: params[k] for k in ("sentiment_backend", "lemmatize", *PAIR_PARAMS) if k in params}}
+
+
+def file_partial(blob, sentiment_backend="textblob", lemmatize=False, graph_window=0, graph_binary=0):
+    """The map step: one segment's mergeable counts.
+
+    Sentiment comes as label counts, histogram and score total; terms as
+    (word, occurrences, documents) for the AGGREGATE_TERMS most frequent
+    words; co-occurrence as (word, word, count) pairs among the
+    AGGREGATE_PAIR_WORDS most frequent, counted as graph_window and
+    graph_binary say. Raises ValueError without a text column.
+    """
+    ctx = AnalysisContext(blob, ["sentiment", "tfidf"], sentiment_backend=sentiment_backend, lemmatize=lemmatize)
+    streamed = ctx.streamed
+    corpus = ctx.corpus
+
+    with timed("term_matrix"):
+        words, counts = corpus.term_matrix()
+        tf = np.asarray(counts.sum(axis=0)).ravel()
+        df = np.asarray((counts > 0).sum(axis=0)).ravel()
+        top = np.argsort(-tf, kind="stable")[:AGGREGATE_TERMS]
+
+    with timed("cooccurrence"):
+        vocab, pairs = cooccurrence_matrix(corpus, top_n=AGGREGATE_PAIR_WORDS, window=graph_window or None,
+                                           binary=bool(graph_binary))
+        pairs = sparse.triu(pairs, k=1).tocoo()
+    return {
+        "sentiment_summary": dict(streamed["summary"]),
+        "sentiment_histogram": streamed["histogram"].tolist(),
+        "sentiment_total": streamed["mean"] * sum(streamed["summary"].values()),
+        "documents": len(corpus),
+        "terms": [[words[i], int(tf[i]), int(df[i])] for i in top],
+        "pairs": [[vocab[i], vocab[j], int(w)] for i, j, w in zip(pairs.row, pairs.col, pairs.data)],
+    }
+
+
+class PartialStore:
+    """Partials by segment id, in their own collection and kept indefinitely.
+
+    A segment never changes, so its partial stays valid for as long as the
+    segment exists (main.py deletes them together) and the pipeline version
+    is the same; unlike the result cache, nothing expires them.
+    """
+
+    def __init__(self, collection, max_bytes=CACHE_MAX_BYTES):
+        self.col = collection
+        self.max_bytes = max_bytes
+        datastore.at_first_request(self.col.create_index, "blob_id")
+
+    @staticmethod
+    def key(segment_id, params):
+        raw = f"{segment_id}:{ANALYSIS_VERSION}:{json.dumps(params, sort_keys=True)}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get_many(self, segment_ids, params):
+        """{segment_id: partial} for the segments with a stored partial, in one query."""
+        keys = {self.key(segment_id, params): segment_id for segment_id in segment_ids}
+        with timed("cache_read"):
+            docs = list(self.col.find({"_id": {"$in": list(keys)}}, {"partial": 1}))
+        return {keys[doc["_id"]]: doc["partial"] for doc in docs}
+
+    def set(self, segment_id, params, partial):
+        doc = {
+            "_id": self.key(segment_id, params),
+            "blob_id": str(segment_id),
+            "version": ANALYSIS_VERSION,
+            "created_at": datetime.now(timezone.utc),
+            "partial": partial,
+        }
+        if len(bson.encode(doc)) > self.max_bytes:
+            count("cache_too_large")
+            return False
+        with timed("cache_write"):
+            self.col.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+        return True
+
+
+class Totals:
+    """The reduce step: partials summed together."""
+
+    def __init__(self):
+        self.summary = Counter()
+        self.histogram = np.zeros(len(HISTOGRAM_EDGES) - 1, dtype=np.int64)
+        self.sentiment_total = 0.0
+        self.documents = 0
+        self.tf = Counter()
+        self.df = Counter()
+        self.pairs = Counter()
+
+    def add(self, partial):
+        self.summary.update(partial["sentiment_summary"])
+        self.histogram += np.asarray(partial["sentiment_histogram"], dtype=np.int64)
+        self.sentiment_total += partial["sentiment_total"]
+        self.documents += partial["documents"]
+        for word, occurrences, documents in partial["terms"]:
+            self.tf[word] += occurrences
+            self.df[word] += documents
+        for a, b, count in partial["pairs"]:
+            self.pairs[(a, b) if a < b else (b, a)] += count
+
+    @property
+    def comments(self):
+        return sum(self.summary.values())
+
+    def sentiment(self):
+        comments = self.comments
+        return {
+            "sentiment_summary": dict(self.summary),
+            "sentiment_histogram": {
+                "edges": HISTOGRAM_EDGES.round(2).tolist(),
+                "counts": self.histogram.tolist(),
+            },
+            "sentiment_mean": self.sentiment_total / comments if comments else 0.0,
+        }
+
+    def tfidf(self, top_n=20):
+        # Corpus-level weights (smoothed idf, as TfidfVectorizer's) since
+        # per-document normalisation cannot be summed across files
+        n = self.documents
+        scores = {w: tf * (math.log((1 + n) / (1 + self.df[w])) + 1) for w, tf in self.tf.items()}
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_n]
+
+    def graph(self, graph_nodes=100, **graph_options):
+        paired = Counter()
+        for (a, b), count in self.pairs.items():
+            paired[a] += count
+            paired[b] += count
+        vocab = [w for w, _ in paired.most_common(graph_nodes)]
+        index = {w: i for i, w in enumerate(vocab)}
+        rows, cols, weights = [], [], []
+        for (a, b), count in self.pairs.items():
+            if a in index and b in index:
+                i, j = sorted((index[a], index[b]))
+                rows.append(i)
+                cols.append(j)
+                weights.append(count)
+        counts = sparse.csr_matrix((np.asarray(weights, dtype=np.int64), (rows, cols)),
+                                   shape=(len(vocab), len(vocab)))
+        return CooccurrenceGraph(vocab, counts, **graph_options)
+
+
+def period_start(when, interval):
+    day = datetime(when.year, when.month, when.day)
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    return day
+
+
+def aggregate(points, interval="day", graph_nodes=100, layout="auto", **graph_options):
+    """Combines (uploaded_at, partial) points into the overall sections and a
+    trend series with one entry per interval that has data."""
+    totals = Totals()
+    periods = defaultdict(Totals)
+    with timed("aggregate_reduce"):
+        for uploaded_at, partial in points:
+            totals.add(partial)
+            periods[period_start(uploaded_at, interval)].add(partial)
+
+    graph = totals.graph(graph_nodes, **graph_options)
+    trend = []
+    for start in sorted(periods):
+        period = periods[start]
+        sentiment = period.sentiment()
+        trend.append({
+            "period": start.strftime("%Y-%m-%d"),
+            "comments": period.comments,
+            "sentiment_mean": sentiment["sentiment_mean"],
+            "sentiment_summary": sentiment["sentiment_summary"],
+            "top_terms": [w for w, _ in period.tf.most_common(TREND_TERMS)],
+        })
+    with timed("layout"):
+        positions = graph.layout(layout)
+    return {
+        **totals.sentiment(),
+        "tfidf": totals.tfidf(),
+        **network_payload(graph, positions),
+        "trend": trend,
+    }
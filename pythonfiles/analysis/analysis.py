@@ -1,195 +1,460 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, redirect, request, jsonify
 from flask_cors import CORS
-from pymongo import MongoClient
-import pandas as pd
 from bson import ObjectId
-from textblob import TextBlob
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
-import networkx as nx
-from collections import Counter
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-import base64
-from io import BytesIO
-import numpy as np
+from bson.errors import InvalidId
 import os
-import string
 import gridfs
-from sklearn.feature_extraction.text import CountVectorizer
+import json
+import time
+import datastore
+import metrics
+from aggregate import (AGGREGATE_MAX_FILES, PartialStore, aggregate, aggregate_params, file_partial,
+                       partial_key_params)
+from jobs import JobQueue, QueueFull, TERMINAL_STATES, job_status
+from pipeline import IMAGE_SECTIONS, SECTIONS, convert_to_serializable, run_analysis, run_sections, section_params
+from graph import GRAPH_PARAMS, PAIR_PARAMS, graph_params
+from segments import segment_chain
+from preprocess import preprocess_params
+from render import IMAGE_FORMATS, ArtifactStore
+from result_cache import LRUCache, MongoCache, ResultCache, cache_key
+from sentiment import BACKENDS as SENTIMENT_BACKENDS
+from topics import TopicModelStore, topic_params
+from warmup import Readiness
 
 # --- Setup ---
 app = Flask(__name__)
 CORS(app)
+# Request latency and stage timings, served on /metrics
+metrics.instrument(app)
+
+# MongoDB setup. Nothing here talks to MongoDB: indexes are created before
+# the first request, so a gunicorn master importing the app stays unconnected
+client, db = datastore.connect(os.getenv("MONGODB_URI"))
+datastore.ensure_indexes(db)
+
+
+@app.before_request
+def setup_datastore():
+    # Health checks and metrics answer without MongoDB
+    if request.endpoint not in ("healthz", "metrics"):
+        datastore.run_setup()
+
 
-# MongoDB setup (no GridFS)
-client = MongoClient(os.getenv("MONGODB_URI"))
-db = client["SocialAnalysis"]
 fs = gridfs.GridFS(db)
 user_history_col = db["user_history"]
 
+# Finished analyses, keyed on blob content + pipeline version
+result_cache = ResultCache(LRUCache(), MongoCache(db["analysis_cache"]))
+
+# Each file segment's aggregate partial, kept as long as the segment
+partial_store = PartialStore(db["aggregate_partials"])
+
+# Background analysis jobs; status lives in MongoDB so any worker can answer polls
+job_queue = JobQueue(db["analysis_jobs"])
+
+# Online topic models per (email, query), used with topic_scope=query
+topic_store = TopicModelStore(db["topic_models"], user_history_col)
+
+# Rendered images, served from /artifacts/<key>
+artifact_store = ArtifactStore(db)
+ARTIFACT_MAX_AGE = int(os.getenv("ANALYSIS_ARTIFACT_MAX_AGE", 365 * 24 * 3600))
+
+# Heavy libraries load on first use; the warm-up runs that use up front, in
+# the gunicorn master (see gunicorn.conf.py) or on a thread at startup
+readiness = Readiness()
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Ready only once warmed up, so a load balancer holds traffic until then
+    status = readiness.status()
+    return jsonify(status), 200 if readiness.ready else 503
+
+
 @app.route('/get-user-files', methods=['GET'])
 def get_user_files():
     email = request.args.get("email")
     if not email:
         return jsonify({"error": "Email is required"}), 400
 
-    # Fetching files uploaded by the user (sorted by latest upload date)
-    files = list(user_history_col.find({"email": email}).sort("upload_date", -1))  # Sorting by latest upload date
+    # Index-backed: file details are stored on each history entry at scrape time
+    history = list(user_history_col.find(
+        {"email": email, "csv_blob_id": {"$exists": True}}, datastore.USER_FILE_FIELDS
+    ).sort("upload_time", -1))
+
+    # Entries from before that have their files looked up in one query
+    missing = [entry["csv_blob_id"] for entry in history if "file_size" not in entry]
+    files = {}
+    if missing:
+        files = {f["_id"]: f for f in db["fs.files"].find(
+            {"_id": {"$in": missing}}, {"filename": 1, "length": 1, "uploadDate": 1})}
 
     formatted_files = []
+    for entry in history:
+        blob_id = entry["csv_blob_id"]
+        if "file_size" in entry:
+            filename, file_size, uploaded = entry.get("filename"), entry["file_size"], entry.get("upload_time")
+        elif blob_id in files:
+            f = files[blob_id]
+            filename, file_size, uploaded = f.get("filename"), f["length"], f["uploadDate"]
+        else:
+            continue  # the file itself is gone
+
+        formatted_files.append({
+            "platform": entry.get("platform", ""),
+            "query": entry.get("query", ""),
+            "csv_blob_id": str(blob_id),
+            "filename": filename,
+            "uploaded_at": uploaded.strftime("%Y-%m-%d %H:%M:%S") if uploaded else "",
+            "file_size": file_size
+        })
+
+    if missing:
+        # Older entries may lack upload_time, so the server-side order is not final
+        formatted_files.sort(key=lambda x: x["uploaded_at"], reverse=True)
+
+    return jsonify({"files": formatted_files}), 200
 
-    for file in files:
-        # Assuming that the 'csv_blob_id' is the reference to the file content
-        blob_id = file.get("csv_blob_id")
-        
-        # Ensure blob_id exists and retrieve file data
-        if blob_id:
-            # Get the file from the database using the blob_id
-            blob = fs.get(ObjectId(blob_id))
-            
-            # Extract file metadata
-            uploaded_time = blob.upload_date.strftime("%Y-%m-%d %H:%M:%S")
-            file_size = blob.length  # File size in bytes
-
-
-            formatted_files.append({
-                "platform": file.get("platform", ""),
-                "query": file.get("query", ""),
-                "csv_blob_id": str(blob._id),
-                "filename": blob.filename,
-                "uploaded_at": uploaded_time,
-                "file_size": file_size
-            })
+
+# Request options that change the analysis output. Only non-default values are
+# kept so default requests share cache entries.
+def analysis_params(args):
+    params = {}
+    backend = args.get("sentiment_backend", "textblob")
+    if backend not in SENTIMENT_BACKENDS:
+        raise ValueError(f"sentiment_backend must be one of {', '.join(SENTIMENT_BACKENDS)}")
+    if backend != "textblob":
+        params["sentiment_backend"] = backend
+    params.update(preprocess_params(args))
+    params.update(topic_params(args))
+    params.update(graph_params(args))
+    return params
+
+
+def requested_sections(args):
+    """Sections named in ?sections=a,b, or None for the full legacy payload."""
+    raw = args.get("sections")
+    if not raw:
+        return None
+    sections = list(dict.fromkeys(s.strip() for s in raw.split(",") if s.strip()))
+    unknown = [s for s in sections if s not in SECTIONS]
+    if unknown or not sections:
+        raise ValueError(f"sections must be a comma-separated list of {', '.join(SECTIONS)}")
+    return sections
+
+
+def result_key(blob, params):
+    """cache_key for a result; with topic_scope=query it also covers the
+    revision of the query's topic model.
+
+    Every later file of the query updates that model, so a result cached
+    before the update would keep an older model's topics. Once the revision
+    moves the next request misses and is computed again. A run that folds
+    its own file in is stored under the revision it started from, so the
+    request after it is computed once more.
+    """
+    if params.get("topic_scope") == "query":
+        params = {**params, "topic_revision": topic_store.revision(str(blob._id))}
+    return cache_key(blob, params)
+
+
+def get_sections(blob, sections, params, sentiment_scores=False, image_format="png"):
+    """Requested sections, each cached on its own so a later request for other
+    sections (or other options of one section) only computes what is new.
+
+    Image sections are not rendered here: they are queued on the job queue
+    and come back under "images" as artifact URLs with their render status.
+    """
+    result = {}
+    images = [s for s in sections if s in IMAGE_SECTIONS]
+    if images:
+        result["images"] = {s: queue_image(blob, s, params, image_format) for s in images}
+    sections = [s for s in sections if s not in IMAGE_SECTIONS]
+
+    keys = {}
+    for section in sections:
+        key_params = section_params(section, params)
+        if section == "sentiment" and sentiment_scores:
+            key_params["sentiment_scores"] = True
+        keys[section] = result_key(blob, {**key_params, "section": section})
+
+    missing = []
+    for section in sections:
+        part = result_cache.get(keys[section])
+        if part is None:
+            missing.append(section)
         else:
-            # If there's no blob_id, log an error or handle it gracefully
-            continue
+            result.update(part)
 
-    # Sort by most recent first
-    sorted_files = sorted(formatted_files, key=lambda x: x["uploaded_at"], reverse=True)
+    if missing:
+        parts = run_sections(blob, missing, sentiment_scores=sentiment_scores,
+                             topic_store=topic_store, fs=fs, **params)
+        if "error" in parts:
+            return parts
+        for section, part in parts.items():
+            part = convert_to_serializable(part)
+            result_cache.set(keys[section], str(blob._id), part)
+            result.update(part)
+    return result
 
-    return jsonify({"files": sorted_files}), 200
 
+def queue_image(blob, section, params, image_format):
+    render_params = {**section_params(section, params), "section": section, "image_format": image_format}
+    key = cache_key(blob, render_params)
+    image = {"url": f"/artifacts/{key}", "status": "done"}
+    if artifact_store.get(key) is None:
+        job, _ = job_queue.submit(str(blob._id), key, render_params, kind="render")
+        image.update(status=job["status"], job_id=job["_id"])
+    return image
 
-# Convert any numpy types (e.g., int64, float64) to standard Python types (e.g., int, float)
-def convert_to_serializable(value):
-    if isinstance(value, (np.int64, np.float64)):
-        return value.item()  # Convert to native Python type (int or float)
-    elif isinstance(value, dict):
-        return {k: convert_to_serializable(v) for k, v in value.items()}
-    elif isinstance(value, list):
-        return [convert_to_serializable(v) for v in value]
-    else:
-        return value
 
 @app.route('/get-analysis', methods=['GET'])
 def get_analysis():
     blob_id = request.args.get("blob_id")
+    try:
+        params = analysis_params(request.args)
+        sections = requested_sections(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
-        # Retrieve the file from GridFS using the blob_id
+        # Only the files document is fetched here; a deleted blob raises before
+        # anything stale can be served from the cache
         blob = fs.get(ObjectId(blob_id))  # Use GridFS to get the file
-        file_data = blob.read()  # Get the file content
-
-        # Process the CSV into DataFrame
-        df = pd.read_csv(BytesIO(file_data))  # Convert the binary content to a CSV DataFrame
-        
-        # Debug: Print the columns and check which column to use
-        print(f"Columns in CSV: {df.columns}")
-        
-        # List of possible text columns for different platforms (Reddit, YouTube, etc.)
-        possible_text_cols = ['text', 'comment', 'Comment', 'body', 'Body', 'message']
-        
-        # Search for the first matching column (case insensitive)
-        text_col = next((col for col in df.columns if col.strip().lower() in [x.lower() for x in possible_text_cols]), None)
-
-        if not text_col:
-            return jsonify({"error": "No valid text column found"}), 400
-        
-        texts = df[text_col].dropna().astype(str).tolist()
-
-        # Sentiment analysis
-        sentiments = [TextBlob(t).sentiment.polarity for t in texts]
-        sentiment_labels = ['positive' if s > 0.05 else 'negative' if s < -0.05 else 'neutral' for s in sentiments]
-        sentiment_counts = Counter(sentiment_labels)
-
-        # TF-IDF
-        tfidf_vectorizer = TfidfVectorizer(stop_words='english', max_features=1000)
-        tfidf_matrix = tfidf_vectorizer.fit_transform(texts)
-        tfidf_words = tfidf_vectorizer.get_feature_names_out()
-        tfidf_scores = tfidf_matrix.sum(axis=0).A1
-        tfidf_data = sorted(zip(tfidf_words, tfidf_scores), key=lambda x: x[1], reverse=True)[:20]
-
-        # Topics
-        lda = LatentDirichletAllocation(n_components=5, random_state=42)
-        lda.fit(tfidf_matrix)
-        topics = []
-        for topic in lda.components_:
-            top_words = [tfidf_words[i] for i in topic.argsort()[-10:]]
-            topics.append(top_words)
-
-        # Co-occurrence graph
-        all_words = [word for text in texts for word in text.lower().split() if word.isalpha()]
-        common_words = [word for word, _ in Counter(all_words).most_common(100)]
-        G = nx.Graph()
-        for text in texts:
-            words = [w for w in text.lower().split() if w in common_words]
-            for i in range(len(words)):
-                for j in range(i + 1, len(words)):
-                    if G.has_edge(words[i], words[j]):
-                        G[words[i]][words[j]]['weight'] += 1
-                    else:
-                        G.add_edge(words[i], words[j], weight=1)
-
-        centralities = nx.degree_centrality(G)
-        centrality_sorted = sorted(centralities.items(), key=lambda x: x[1], reverse=True)[:10]
-
-        network_data = {
-            'nodes': [{'id': node} for node in G.nodes()],
-            'edges': [{'source': u, 'target': v, 'weight': d['weight']} for u, v, d in G.edges(data=True)]
-        }
-
-        # Word cloud image
-        wordcloud = WordCloud(width=800, height=400, background_color='white').generate(' '.join(all_words))
-        wc_img = BytesIO()
-        wordcloud.to_image().save(wc_img, format='PNG')
-        wc_img.seek(0)
-        wordcloud_base64 = base64.b64encode(wc_img.read()).decode('utf-8')
-
-        # Co-occurrence graph image using spring_layout (pure matplotlib)
-        pos = nx.spring_layout(G, seed=42, k=0.5)
-
-        fig, ax = plt.subplots(figsize=(10, 8))
-        nx.draw_networkx_nodes(G, pos, node_size=600, node_color='lightblue', ax=ax)
-        nx.draw_networkx_edges(G, pos, width=[G[u][v]['weight'] * 0.1 for u, v in G.edges()], alpha=0.6, ax=ax)
-        nx.draw_networkx_labels(G, pos, font_size=10, ax=ax)
-        ax.set_title(" ", fontsize=14)
-        ax.axis('off')
-
-        co_img = BytesIO()
-        plt.savefig(co_img, format='PNG', bbox_inches='tight')
-        co_img.seek(0)
-        cooccurrence_base64 = base64.b64encode(co_img.read()).decode('utf-8')
-        co_img.close()
-        plt.close()
-
-        result = {
-            'sentiments': sentiments,
-            'sentiment_summary': dict(sentiment_counts),
-            'topics': topics,
-            'tfidf': tfidf_data,
-            'network': network_data,
-            'centralities': centrality_sorted,
-            'wordcloud': wordcloud_base64,
-            'cooccurrence_img': cooccurrence_base64
-        }
+        if sections is not None:
+            # Only what the dashboard asks for is computed; sentiment comes as a
+            # histogram unless one score per comment is asked for
+            scores = request.args.get("sentiment_scores", "").lower() in ("1", "true", "yes")
+            image_format = request.args.get("image_format", "png")
+            if image_format not in IMAGE_FORMATS:
+                return jsonify({"error": f"image_format must be one of {', '.join(IMAGE_FORMATS)}"}), 400
+            try:
+                result = get_sections(blob, sections, params, sentiment_scores=scores, image_format=image_format)
+            except QueueFull as e:
+                return jsonify({"error": str(e)}), 429
+            if "error" in result:
+                return jsonify(result), 400
+            return jsonify(result)
+
+        key = result_key(blob, params)
+        result = result_cache.get(key)
+        if result is None:
+            result = run_analysis(blob, topic_store=topic_store, fs=fs, **params)
+            if "error" in result:
+                return jsonify(result), 400
+            result = convert_to_serializable(result)
+            result_cache.set(key, str(blob._id), result)
 
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-    
+# ========== AGGREGATE ANALYSIS ==========
+
+def aggregate_blob_ids(args, start=None):
+    """Files named by blob_ids=a,b,c, or the user's scrapes for email (and query)."""
+    raw_ids = args.get("blob_ids", "")
+    if raw_ids:
+        try:
+            return [ObjectId(b.strip()) for b in raw_ids.split(",") if b.strip()]
+        except InvalidId:
+            raise ValueError("blob_ids must be comma-separated file ids")
+    email = args.get("email")
+    if not email:
+        raise ValueError("blob_ids or email is required")
+    filter = {"email": email}
+    if args.get("query") is not None:
+        filter["query"] = args["query"]
+    if start is not None:
+        # An entry's upload time is its newest segment's, so older entries
+        # have nothing in range
+        filter["upload_time"] = {"$gte": start}
+    return [e["csv_blob_id"] for e in user_history_col.find(filter, {"csv_blob_id": 1}).sort("upload_time", -1)]
+
+
+@app.route('/aggregate-analysis', methods=['GET'])
+def aggregate_analysis():
+    """Sentiment, terms, network and trends over many files at once.
+
+    Each file (each segment of an incrementally scraped one) is reduced to
+    mergeable counts that are cached on their own, so adding a file to a
+    comparison only costs that file's work. start and end limit the
+    segments by upload time; interval sets the trend's period.
+    """
+    try:
+        params = analysis_params(request.args)
+        interval, start, end = aggregate_params(request.args)
+        blob_ids = list(dict.fromkeys(aggregate_blob_ids(request.args, start)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not blob_ids:
+        return jsonify({"error": "No files to aggregate"}), 404
+    if len(blob_ids) > AGGREGATE_MAX_FILES:
+        return jsonify({"error": f"At most {AGGREGATE_MAX_FILES} files can be aggregated"}), 400
+
+    try:
+        partial_params = partial_key_params(params)
+        points, files, skipped = [], [], []
+        chains = []
+        for blob_id in blob_ids:
+            try:
+                blob = fs.get(blob_id)
+            except gridfs.NoFile:
+                skipped.append({"blob_id": str(blob_id), "error": "File not found"})
+                continue
+            segments = [s for s in segment_chain(fs, blob)
+                        if (start is None or s.upload_date >= start) and (end is None or s.upload_date < end)]
+            if segments:
+                chains.append(segments)
+                files.append({"blob_id": str(blob_id), "filename": blob.filename, "segments": len(segments)})
+
+        stored = partial_store.get_many([s._id for segments in chains for s in segments], partial_params)
+        computed = 0
+        for segment in (s for segments in chains for s in segments):
+            partial = stored.get(segment._id)
+            if partial is None:
+                try:
+                    with metrics.timed("aggregate_partial"):
+                        partial = file_partial(segment, **{k: v for k, v in partial_params.items()
+                                                           if k != "aggregate_partial"})
+                except ValueError as e:
+                    skipped.append({"blob_id": str(segment._id), "error": str(e)})
+                    continue
+                partial_store.set(segment._id, partial_params, partial)
+                computed += 1
+            points.append((segment.upload_date, partial))
+
+        # Pair counting options were applied by file_partial
+        graph_options = {k: v for k, v in params.items()
+                         if (k in GRAPH_PARAMS and k not in PAIR_PARAMS) or k == "layout"}
+        result = aggregate(points, interval, **graph_options)
+        return jsonify(convert_to_serializable({
+            "files": files,
+            "skipped": skipped,
+            "computed": computed,
+            **result,
+        }))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ========== ANALYSIS JOBS ==========
+
+JOB_POLL_INTERVAL = float(os.getenv("ANALYSIS_JOB_POLL_INTERVAL", 0.5))
+
+@app.route('/analysis-jobs', methods=['POST'])
+def create_analysis_job():
+    data = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    blob_id = data.get("blob_id")
+    if not blob_id:
+        return jsonify({"error": "blob_id is required"}), 400
+    try:
+        params = analysis_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        blob = fs.get(ObjectId(blob_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+
+    key = result_key(blob, params)
+    try:
+        if result_cache.get(key) is not None:
+            job = job_queue.completed(str(blob._id), key)
+        else:
+            job, _ = job_queue.submit(str(blob._id), key, params)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify(job_status(job)), 202
+
+
+def job_file_exists(job):
+    # A job outlives its file; its result must not be served once the file is gone
+    return fs.exists(ObjectId(job["blob_id"]))
+
+
+@app.route('/analysis-jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job)), 200
+
+
+@app.route('/analysis-jobs/<job_id>/result', methods=['GET'])
+def get_analysis_job_result(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed":
+        return jsonify(job_status(job)), 500
+    if job["status"] != "done":
+        return jsonify(job_status(job)), 202
+    if job.get("kind") == "render":
+        return redirect(f"/artifacts/{job['key']}", code=303)
+
+    if not job_file_exists(job):
+        return jsonify({"error": "File not found"}), 404
+    result = result_cache.get(job["key"])
+    if result is None:
+        return jsonify({"error": "Result has expired, submit the analysis again"}), 410
+    return jsonify(result)
+
+
+@app.route('/analysis-jobs/<job_id>/events', methods=['GET'])
+def stream_analysis_job(job_id):
+    if not job_queue.get(job_id):
+        return jsonify({"error": "Job not found"}), 404
+
+    # Server-sent events: a status event on every change, then the result
+    def events():
+        last = None
+        while True:
+            job = job_queue.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            status = job_status(job)
+            if status != last:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+                last = status
+            if job["status"] == "done":
+                if not job_file_exists(job):
+                    yield f"event: error\ndata: {json.dumps({'error': 'File not found'})}\n\n"
+                    return
+                result = result_cache.get(job["key"])
+                if result is None:
+                    yield f"event: error\ndata: {json.dumps({'error': 'Result has expired'})}\n\n"
+                else:
+                    yield f"event: result\ndata: {json.dumps(result)}\n\n"
+                return
+            if job["status"] in TERMINAL_STATES:
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# ========== ARTIFACTS ==========
+
+@app.route('/artifacts/<key>', methods=['GET'])
+def get_artifact(key):
+    artifact = artifact_store.get(key)
+    if artifact is None:
+        job = job_queue.active(key)
+        if job is None:
+            return jsonify({"error": "Artifact not found"}), 404
+        return jsonify(job_status(job)), 202, {"Retry-After": "1"}
+
+    # Keys are content-addressed, so a stored artifact never changes
+    headers = {"ETag": f'"{key}"', "Cache-Control": f"public, max-age={ARTIFACT_MAX_AGE}, immutable"}
+    if key in request.if_none_match:
+        return Response(status=304, headers=headers)
+    return Response(artifact.read(), mimetype=artifact.metadata["content_type"], headers=headers)
+
 
 if __name__ == "__main__":
+    readiness.start()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
\ No newline at end of file
@@ -0,0 +1,106 @@
+import numpy as np
+from scipy import sparse
+
+
+def cooccurrence_matrix(corpus, top_n=100, window=None, binary=False):
+    """Count how often pairs of the top_n most frequent words appear together.
+
+    corpus is a preprocess.Corpus. Returns (vocab, counts) where counts is an
+    upper-triangular CSR matrix over vocab. By default every pair of
+    occurrences within a text counts once, so a and b appearing 2 and 3
+    times give a weight of 6, and a repeated word pairs with itself on the
+    diagonal. window limits pairs to words at most that many tokens apart
+    (stop words are not counted); binary counts each pair at most once per
+    text.
+    """
+    if not corpus.vocab:  # no words at all
+        return [], sparse.csr_matrix((0, 0), dtype=np.int64)
+    freqs = corpus.frequencies()
+    top = np.argsort(-freqs, kind="stable")[:top_n]
+    # Alphabetical, as the words came out of CountVectorizer before
+    top = top[np.argsort(np.asarray(corpus.vocab, dtype=object)[top])]
+    vocab = [corpus.vocab[i] for i in top]
+
+    if window is None:
+        _, X = corpus.term_matrix(vocabulary=vocab)
+        counts = _document_counts(X, binary)
+    else:
+        counts = _window_counts(corpus, top, window, binary)
+    counts = sparse.triu(counts).tocsr()
+    counts.eliminate_zeros()
+    return vocab, counts
+
+
+def _document_counts(X, binary):
+    if binary:
+        X = X.copy()
+        X.data[:] = 1
+        counts = (X.T @ X).tolil()
+        counts.setdiag(0)
+        return counts.tocsr()
+
+    # Off the diagonal X^T X gives count_a * count_b per text, exactly the
+    # number of occurrence pairs. A word repeated n times pairs with itself
+    # n(n-1)/2 times, i.e. (sum n^2 - sum n) / 2 over texts.
+    counts = (X.T @ X).tolil()
+    squares = counts.diagonal()
+    totals = np.asarray(X.sum(axis=0)).ravel()
+    counts.setdiag((squares - totals) // 2)
+    return counts.tocsr()
+
+
+def _window_counts(corpus, top, window, binary):
+    # Every kept token as (text, position in text, index into top)
+    index = np.full(len(corpus.vocab), -1, dtype=np.int64)
+    index[top] = np.arange(len(top))
+    offsets = corpus.offsets
+    docs = np.repeat(np.arange(len(corpus)), np.diff(offsets))
+    positions = np.arange(len(docs)) - offsets[docs]
+    ids = index[corpus.ids]
+    kept = ids >= 0
+    docs, positions, ids = docs[kept], positions[kept], ids[kept]
+
+    # Pair each kept token with the kept tokens 1..window places after it;
+    # since tokens were filtered, positions still need checking against window
+    n = len(top)
+    rows, cols, pair_docs = [], [], []
+    for offset in range(1, window + 1):
+        if offset >= len(ids):
+            break
+        mask = (docs[:-offset] == docs[offset:]) & (positions[offset:] - positions[:-offset] <= window)
+        a, b = ids[:-offset][mask], ids[offset:][mask]
+        rows.append(np.minimum(a, b))
+        cols.append(np.maximum(a, b))
+        pair_docs.append(docs[:-offset][mask])
+    if not rows:
+        return sparse.csr_matrix((n, n), dtype=np.int64)
+    rows, cols, pair_docs = np.concatenate(rows), np.concatenate(cols), np.concatenate(pair_docs)
+
+    if binary:
+        keys = np.unique((pair_docs * n + rows) * n + cols)
+        rows, cols = (keys // n) % n, keys % n
+        keep = rows != cols
+        rows, cols = rows[keep], cols[keep]
+
+    data = np.ones(len(rows), dtype=np.int64)
+    return sparse.coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr()
+
+
+def degree_centrality(vocab, counts):
+    """networkx-compatible degree centrality computed on the sparse counts.
+
+    Only words with at least one pair are nodes; a self-loop adds 2 to degree.
+    """
+    if counts.nnz == 0:
+        return {}
+    pattern = counts.copy()
+    pattern.data[:] = 1
+    diag = pattern.diagonal()
+    off = pattern - sparse.diags(diag, dtype=pattern.dtype)
+    degree = np.asarray(off.sum(axis=0)).ravel() + np.asarray(off.sum(axis=1)).ravel() + 2 * diag
+    nodes = np.flatnonzero(degree)
+    if len(nodes) <= 1:
+        return {vocab[i]: 1.0 for i in nodes}
+    scale = 1.0 / (len(nodes) - 1)
+    return {vocab[i]: float(degree[i] * scale) for i in nodes}
+
@@ -0,0 +1,81 @@
+import os
+import threading
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+from metrics import MongoCommandTimer
+
+DB_NAME = "SocialAnalysis"
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", 60000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+# Analyses stream large scrapes from GridFS, so individual reads get more room
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 60000))
+
+# History fields /get-user-files shows
+USER_FILE_FIELDS = {"_id": 0, "platform": 1, "query": 1, "csv_blob_id": 1, "filename": 1,
+                    "upload_time": 1, "file_size": 1}
+
+
+def connect(uri):
+    # connect=False defers opening sockets and monitor threads until the first
+    # operation. Importing the app runs none (see at_first_request), so under
+    # gunicorn's preload_app the master's client is still unopened when the
+    # workers fork, and each worker connects on its own.
+    client = MongoClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        connect=False,
+        # Every command's time goes to the mongo_<command> stage metrics
+        event_listeners=[MongoCommandTimer()],
+    )
+    return client, client[DB_NAME]
+
+
+_setup = []
+_setup_lock = threading.Lock()
+
+
+def at_first_request(setup, *args, **kwargs):
+    """Queues setup(*args, **kwargs), such as creating an index, for run_setup.
+
+    Stores queue their index creation here rather than running it when they
+    are constructed, which happens at import.
+    """
+    with _setup_lock:
+        _setup.append((setup, args, kwargs))
+
+
+def run_setup():
+    """Runs the queued setup; the app calls this before every request, so
+    each process runs it before its first. What fails stays queued."""
+    if not _setup:
+        return
+    with _setup_lock:
+        while _setup:
+            setup, args, kwargs = _setup[0]
+            setup(*args, **kwargs)
+            _setup.pop(0)
+
+
+def ensure_indexes(db):
+    # Shared with the scraper service, which creates the same indexes
+    at_first_request(db["user_history"].create_index, [("email", ASCENDING), ("upload_time", DESCENDING)])
+    at_first_request(db["user_history"].create_index, "csv_blob_id")
+
+
+def ensure_expiry_index(collection):
+    """Has MongoDB delete each document of collection at its expires_at.
+
+    Lifetimes are set on each document as it is written, so changing a TTL
+    setting takes effect without touching the index.
+    """
+    collection.create_index("expires_at", expireAfterSeconds=0)
@@ -0,0 +1,134 @@
+import os
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+from cooccurrence import degree_centrality
+from options import numeric_params
+
+# Default cap on edges kept for the network payload and image
+GRAPH_MAX_EDGES = int(os.getenv("GRAPH_MAX_EDGES", 1000))
+
+# Request parameter -> (type, default, minimum, maximum)
+GRAPH_PARAMS = {
+    # Most frequent words taken as nodes
+    "graph_nodes": (int, 100, 2, 2000),
+    "graph_min_weight": (int, 1, 1, 10 ** 9),
+    # Pointwise mutual information of a pair; unset keeps every pair
+    "graph_min_pmi": (float, None, -100.0, 100.0),
+    # Keep only each word's k heaviest pairs; 0 keeps all
+    "graph_top_k": (int, 0, 0, 2000),
+    "graph_max_edges": (int, GRAPH_MAX_EDGES, 1, 100000),
+    # Pair only words at most this many tokens apart; 0 pairs all the words of
+    # a comment
+    "graph_window": (int, 0, 0, 1000),
+    # 1 counts a pair at most once per comment
+    "graph_binary": (int, 0, 0, 1),
+}
+# The ones that change how pairs are counted rather than which are kept
+PAIR_PARAMS = ("graph_window", "graph_binary")
+
+LAYOUTS = ("auto", "spring", "spectral", "circular")
+# Above this many nodes "auto" uses the spectral layout: one sparse eigen
+# decomposition instead of spring_layout's O(n^2) work per iteration
+LAYOUT_SPRING_MAX_NODES = int(os.getenv("LAYOUT_SPRING_MAX_NODES", 300))
+
+
+def graph_params(args):
+    """Non-default graph options from request args; raises ValueError when invalid."""
+    params = numeric_params(args, GRAPH_PARAMS)
+    layout = args.get("layout", "auto")
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}")
+    if layout != "auto":
+        params["layout"] = layout
+    return params
+
+
+def prune_edges(counts, min_weight=1, min_pmi=None, top_k=0, max_edges=GRAPH_MAX_EDGES):
+    """(rows, cols, weights) of the word pairs kept from upper-triangular counts.
+
+    Self pairs are dropped, then pairs below min_weight or min_pmi, then pairs
+    outside the top_k heaviest of both their words, then all but the
+    max_edges heaviest. Everything runs on the sparse entries, so the cost
+    follows the number of pairs rather than the number of comments.
+    """
+    upper = sparse.triu(counts, k=1).tocoo()
+    rows, cols, weights = upper.row, upper.col, upper.data
+
+    keep = weights >= min_weight
+    if min_pmi is not None and len(weights):
+        # Marginals from the pair counts themselves, as for a co-occurrence matrix
+        strength = np.asarray((upper + upper.T).sum(axis=1)).ravel().astype(float)
+        with np.errstate(divide="ignore"):
+            pmi = np.log(weights * strength.sum() / (strength[rows] * strength[cols]))
+        keep &= pmi >= min_pmi
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+
+    if top_k and len(weights):
+        # Rank each pair among both endpoints' pairs; keep it if it is in
+        # the top_k of either word
+        ends = np.concatenate([rows, cols])
+        edge_ids = np.tile(np.arange(len(weights)), 2)
+        order = np.lexsort((-np.tile(weights, 2), ends))
+        group_start = np.searchsorted(ends[order], ends[order], side="left")
+        rank = np.arange(len(order)) - group_start
+        kept = np.zeros(len(weights), dtype=bool)
+        kept[edge_ids[order][rank < top_k]] = True
+        rows, cols, weights = rows[kept], cols[kept], weights[kept]
+
+    if len(weights) > max_edges:
+        heaviest = np.sort(np.argsort(-weights, kind="stable")[:max_edges])
+        rows, cols, weights = rows[heaviest], cols[heaviest], weights[heaviest]
+    return rows, cols, weights
+
+
+class CooccurrenceGraph:
+    """A co-occurrence network built on the sparse pair counts.
+
+    Centralities come from the full counts so they do not move with the
+    pruning options; the pruned edges are what gets drawn and sent to
+    clients, so payload size and layout time stay bounded.
+    """
+
+    def __init__(self, vocab, counts, graph_min_weight=1, graph_min_pmi=None, graph_top_k=0,
+                 graph_max_edges=GRAPH_MAX_EDGES):
+        self.vocab = vocab
+        self.counts = counts
+        self.rows, self.cols, self.weights = prune_edges(
+            counts, graph_min_weight, graph_min_pmi, graph_top_k, graph_max_edges)
+
+    def degree_centrality(self):
+        return degree_centrality(self.vocab, self.counts)
+
+    def weighted_centrality(self):
+        # Each word's total pair weight with other words, relative to the
+        # strongest word
+        off = sparse.triu(self.counts, k=1)
+        strength = np.asarray((off + off.T).sum(axis=1)).ravel().astype(float)
+        if not strength.any():
+            return {}
+        strength /= strength.max()
+        return {self.vocab[i]: float(strength[i]) for i in np.flatnonzero(strength)}
+
+    def edges(self):
+        return [(self.vocab[i], self.vocab[j], int(w)) for i, j, w in zip(self.rows, self.cols, self.weights)]
+
+    def to_networkx(self):
+        G = nx.Graph()
+        G.add_weighted_edges_from(self.edges())
+        return G
+
+    def layout(self, layout="auto"):
+        """{word: (x, y)} for the pruned graph."""
+        G = self.to_networkx()
+        if layout == "auto":
+            layout = "spring" if G.number_of_nodes() <= LAYOUT_SPRING_MAX_NODES else "spectral"
+        if layout == "spectral" and G.number_of_nodes() > 2:
+            pos = nx.spectral_layout(G)
+        elif layout == "circular":
+            pos = nx.circular_layout(G)
+        else:
+            pos = nx.spring_layout(G, seed=42, k=0.5)
+        return {node: (round(float(x), 4), round(float(y), 4)) for node, (x, y) in pos.items()}
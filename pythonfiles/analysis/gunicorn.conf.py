@@ -0,0 +1,30 @@
+# gunicorn analysis:app, run from this directory, picks this file up
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 10000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+# Full analyses of large files run inside the request
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 300))
+
+# The app is imported and warmed up once in the master, then workers fork
+# from it: they start ready, and share the loaded libraries copy-on-write
+# instead of each loading its own. GUNICORN_PRELOAD=0 has each worker import
+# and warm up by itself, e.g. to pick up code changes with a HUP.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+
+def when_ready(server):
+    # Runs in the master once it is listening, before the first worker forks
+    if preload_app:
+        import analysis
+
+        analysis.readiness.run()
+        server.log.info("Warmed up in %.1fs", analysis.readiness.seconds)
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        import analysis
+
+        analysis.readiness.start()
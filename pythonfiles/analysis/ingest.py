@@ -0,0 +1,133 @@
+import gzip
+import logging
+import os
+import random
+
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+# List of possible text columns for different platforms (Reddit, YouTube, etc.)
+POSSIBLE_TEXT_COLS = ['text', 'comment', 'Comment', 'body', 'Body', 'message']
+
+CHUNK_ROWS = int(os.getenv("ANALYSIS_CHUNK_ROWS", 20000))
+# 0 keeps every text for the corpus-level stages (TF-IDF, topics, graph);
+# otherwise a uniform sample of this many is kept while sentiment still
+# covers every row
+MAX_TEXTS = int(os.getenv("ANALYSIS_MAX_TEXTS", 0))
+
+
+def find_text_column(columns):
+    # First matching column, case insensitive
+    wanted = {x.lower() for x in POSSIBLE_TEXT_COLS}
+    return next((col for col in columns if col.strip().lower() in wanted), None)
+
+
+class _TimedReader:
+    # A GridFS file whose reads are timed as the gridfs_read stage, so the
+    # wait on MongoDB can be told apart from parsing
+    def __init__(self, blob):
+        self._blob = blob
+
+    def read(self, size=-1):
+        with timed("gridfs_read"):
+            return self._blob.read(size)
+
+    def readinto(self, buffer):
+        with timed("gridfs_read"):
+            return self._blob.readinto(buffer)
+
+    def readline(self, size=-1):
+        with timed("gridfs_read"):
+            return self._blob.readline(size)
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def __getattr__(self, name):
+        return getattr(self._blob, name)
+
+
+def _open(blob):
+    # Scrapes may be stored gzip-compressed; the format is in the file's metadata
+    reader = _TimedReader(blob)
+    if (blob.metadata or {}).get("format") == "csv.gz":
+        return gzip.GzipFile(fileobj=reader, mode="rb")
+    return reader
+
+
+def open_text_chunks(blob, chunksize=CHUNK_ROWS):
+    """Returns (text_col, chunks) where chunks yields lists of non-empty texts.
+
+    Only the text column is decoded, and the blob is read from GridFS as the
+    parser needs it, so memory holds one chunk of rows rather than the whole
+    file. Files written by the scrapers name their text column in metadata;
+    older files are matched against POSSIBLE_TEXT_COLS. Raises ValueError
+    when no text column is found.
+    """
+    metadata = blob.metadata or {}
+    if metadata.get("format") == "parquet":
+        return _open_parquet_chunks(blob, metadata.get("text_column"), chunksize)
+
+    import pandas as pd
+
+    header = pd.read_csv(_open(blob), nrows=0)
+    log.debug("Columns in %s: %s", blob.filename, list(header.columns))
+    text_col = metadata.get("text_column") or find_text_column(header.columns)
+    if not text_col:
+        raise ValueError("No valid text column found")
+    blob.seek(0)
+
+    def chunks():
+        reader = pd.read_csv(_open(blob), usecols=[text_col], dtype=str, chunksize=chunksize)
+        with reader:
+            for frame in reader:
+                yield frame[text_col].dropna().tolist()
+
+    return text_col, chunks()
+
+
+def open_segment_chunks(segments, chunksize=CHUNK_ROWS):
+    """open_text_chunks over every segment of a dataset, as one stream of chunks."""
+    opened = [open_text_chunks(segment, chunksize) for segment in segments]
+    return opened[-1][0], (chunk for _, chunks in opened for chunk in chunks)
+
+
+def _open_parquet_chunks(blob, text_col, chunksize):
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(_TimedReader(blob))
+    text_col = text_col or find_text_column(parquet.schema_arrow.names)
+    if not text_col:
+        raise ValueError("No valid text column found")
+
+    # Column pages for the other fields are never read or decompressed
+    def chunks():
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=[text_col]):
+            yield [t for t in batch.column(0).to_pylist() if t]
+
+    return text_col, chunks()
+
+
+class TextSample:
+    """Collects texts, keeping a uniform reservoir sample once max_size is reached."""
+
+    def __init__(self, max_size=MAX_TEXTS, seed=42):
+        self.max_size = max_size
+        self.texts = []
+        self.seen = 0
+        self._rng = random.Random(seed)
+
+    def extend(self, texts):
+        if not self.max_size:
+            self.texts.extend(texts)
+            self.seen += len(texts)
+            return
+        for text in texts:
+            self.seen += 1
+            if len(self.texts) < self.max_size:
+                self.texts.append(text)
+            else:
+                i = self._rng.randrange(self.seen)
+                if i < self.max_size:
+                    self.texts[i] = text
@@ -0,0 +1,262 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+import gridfs
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+import datastore
+import metrics
+import sentiment
+from pipeline import convert_to_serializable, render_image, run_analysis, section_params
+from render import IMAGE_FORMATS, ArtifactStore
+from result_cache import LRUCache, MongoCache, ResultCache, cache_key
+from topics import TopicModelStore
+
+JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.getenv("ANALYSIS_JOB_MAX_PENDING", 32))
+JOB_TTL_SECONDS = int(os.getenv("ANALYSIS_JOB_TTL", 24 * 3600))
+# A queued/running job untouched for this long is assumed lost (e.g. the web
+# worker that owned it was restarted) and no longer blocks resubmission
+JOB_STALE_SECONDS = int(os.getenv("ANALYSIS_JOB_STALE", 15 * 60))
+
+TERMINAL_STATES = ("done", "failed")
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _finish(col, job_id, status, error=None):
+    fields = {"status": status, "error": error, "updated_at": _now()}
+    if status == "done":
+        fields.update({"stage": "done", "progress": 1.0})
+    col.update_one({"_id": job_id}, {"$set": fields, "$unset": {"active_key": ""}})
+
+
+def job_status(job):
+    return {
+        "job_id": job["_id"],
+        "blob_id": job["blob_id"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "progress": job.get("progress", 0.0),
+        "error": job.get("error"),
+        "kind": job.get("kind", "analysis"),
+    }
+
+
+class JobQueue:
+    """Runs analyses on a bounded process pool, tracking each job in MongoDB.
+
+    Identical in-flight requests (same cache key) share one job: only queued
+    and running jobs carry active_key, which has a unique index.
+    """
+
+    def __init__(self, collection, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        self.col = collection
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        datastore.at_first_request(datastore.ensure_expiry_index, self.col)
+        datastore.at_first_request(self.col.create_index, "active_key", unique=True, sparse=True)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn rather than fork: a forked child would inherit this
+            # process's MongoClient and its background threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    def get(self, job_id):
+        return self.col.find_one({"_id": job_id})
+
+    def active(self, key):
+        # The queued or running job for key, if any
+        return self.col.find_one({"active_key": key})
+
+    def completed(self, blob_id, key):
+        # Record an already-cached result as a finished job so clients can
+        # treat every submission the same way
+        job = self._new_job(blob_id, key, status="done")
+        self.col.insert_one(job)
+        return job
+
+    def submit(self, blob_id, key, params=None, kind="analysis"):
+        """Returns (job, created); created is False when an identical job was in flight.
+
+        kind is "analysis" (the full result, stored in the result cache) or
+        "render" (one image section, stored as an artifact under key).
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull("Too many analyses in progress, try again shortly")
+
+            job = self._new_job(blob_id, key, status="queued", kind=kind)
+            for _ in range(2):
+                try:
+                    self.col.insert_one(job)
+                    break
+                except DuplicateKeyError:
+                    existing = self.col.find_one({"active_key": key})
+                    if existing is None:
+                        continue
+                    cutoff = _now() - timedelta(seconds=JOB_STALE_SECONDS)
+                    # Stored times are UTC, read back naive unless the client is tz_aware
+                    if existing["updated_at"].replace(tzinfo=timezone.utc) > cutoff:
+                        return existing, False
+                    _finish(self.col, existing["_id"], "failed", error="Job was lost")
+            else:
+                return self.col.find_one({"active_key": key}), False
+
+            self._pending += 1
+
+        task = TASKS[kind]
+        executor = self._get_executor()
+        try:
+            future = executor.submit(task, job["_id"], blob_id, key, params)
+        except BrokenProcessPool:
+            # Shut the broken pool down so its management thread and any
+            # surviving workers exit, then retry on a fresh one
+            if self._executor is executor:
+                self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            future = self._get_executor().submit(task, job["_id"], blob_id, key, params)
+        future.add_done_callback(lambda f: self._on_done(job["_id"], f))
+        return job, True
+
+    def _new_job(self, blob_id, key, status, kind="analysis"):
+        now = _now()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "kind": kind,
+            "key": key,
+            "blob_id": blob_id,
+            "status": status,
+            "stage": "done" if status == "done" else None,
+            "progress": 1.0 if status == "done" else 0.0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + timedelta(seconds=JOB_TTL_SECONDS),
+        }
+        if status not in TERMINAL_STATES:
+            job["active_key"] = key
+        return job
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            self._pending -= 1
+        error = future.exception()
+        if error is None:
+            # Stages timed in the worker process, which this /metrics cannot see
+            metrics.record(future.result() or {})
+            return
+        # run_job records its own failures, so this is a crashed worker process
+        if isinstance(error, BrokenProcessPool):
+            self._executor = None
+        _finish(self.col, job_id, "failed", error=str(error) or "Worker process died")
+
+
+# --- Worker process side ---
+
+_worker = {}
+
+
+def _init_worker():
+    # Each job already has a core to itself
+    sentiment.disable_parallelism()
+    _, db = datastore.connect(os.getenv("MONGODB_URI"))
+    _worker["fs"] = gridfs.GridFS(db)
+    _worker["jobs"] = db["analysis_jobs"]
+    # No LRU tier here: results must land in MongoDB for the web process to read
+    _worker["cache"] = ResultCache(LRUCache(max_entries=0), MongoCache(db["analysis_cache"]))
+    _worker["topics"] = TopicModelStore(db["topic_models"], db["user_history"])
+    _worker["artifacts"] = ArtifactStore(db)
+
+
+def _progress_reporter(jobs, job_id):
+    def progress(stage, fraction):
+        jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "running", "stage": stage, "progress": fraction, "updated_at": _now()}},
+        )
+    return progress
+
+
+def run_job(job_id, blob_id, key, params=None):
+    # Returns the job's stage timings for the web process to record
+    with metrics.collect() as timings, metrics.timed("job_analysis"):
+        _run_job(job_id, blob_id, key, params)
+    return timings
+
+
+def _run_job(job_id, blob_id, key, params=None):
+    jobs = _worker["jobs"]
+    progress = _progress_reporter(jobs, job_id)
+    try:
+        blob = _worker["fs"].get(ObjectId(blob_id))
+        result = run_analysis(blob, progress=progress, topic_store=_worker["topics"], fs=_worker["fs"],
+                              **(params or {}))
+        if "error" in result:
+            raise ValueError(result["error"])
+        result = convert_to_serializable(result)
+        if not _worker["cache"].set(key, blob_id, result):
+            raise ValueError("Analysis result is too large to store")
+    except Exception as e:
+        _finish(jobs, job_id, "failed", error=str(e))
+        return
+    _finish(jobs, job_id, "done")
+
+
+def run_render_job(job_id, blob_id, key, params):
+    with metrics.collect() as timings, metrics.timed("job_render"):
+        _run_render_job(job_id, blob_id, key, params)
+    return timings
+
+
+def _run_render_job(job_id, blob_id, key, params):
+    # params carries the section and image_format besides the analysis options
+    jobs = _worker["jobs"]
+    params = dict(params)
+    section = params.pop("section")
+    image_format = params.pop("image_format", "png")
+    try:
+        blob = _worker["fs"].get(ObjectId(blob_id))
+        if section == "cooccurrence_img":
+            params["positions"] = _cached_positions(blob, params)
+        data = render_image(blob, section, image_format, progress=_progress_reporter(jobs, job_id),
+                            fs=_worker["fs"], **params)
+        _worker["artifacts"].put(key, blob_id, data, IMAGE_FORMATS[image_format])
+    except Exception as e:
+        _finish(jobs, job_id, "failed", error=str(e))
+        return
+    _finish(jobs, job_id, "done")
+
+
+def _cached_positions(blob, params):
+    # Draw with the coordinates the network section already sent, when it has
+    # been computed, so the image matches the interactive graph
+    key = cache_key(blob, {**section_params("network", params), "section": "network"})
+    network = _worker["cache"].get(key)
+    if network is None:
+        return None
+    return {node["id"]: (node["x"], node["y"]) for node in network["network"]["nodes"]}
+
+
+TASKS = {"analysis": run_job, "render": run_render_job}
@@ -0,0 +1,18 @@
+def numeric_params(args, spec):
+    """Non-default numeric options from request args; raises ValueError when invalid.
+
+    spec maps parameter name -> (type, default, minimum, maximum).
+    """
+    params = {}
+    for name, (kind, default, low, high) in spec.items():
+        if args.get(name) in (None, ""):
+            continue
+        try:
+            value = kind(args[name])
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number")
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}")
+        if value != default:
+            params[name] = value
+    return params
@@ -0,0 +1,299 @@
+import base64
+from collections import Counter
+from functools import cached_property
+
+import numpy as np
+
+from cooccurrence import cooccurrence_matrix
+from graph import GRAPH_MAX_EDGES, GRAPH_PARAMS, CooccurrenceGraph
+from ingest import MAX_TEXTS, TextSample, open_segment_chunks, open_text_chunks
+from metrics import timed, timed_iter
+from preprocess import Corpus
+from render import render_graph, render_wordcloud
+from segments import segment_chain
+from sentiment import label, score_texts
+from topics import TOPIC_PARAMS, count_matrix, fit_topics, top_tfidf
+
+# Sections of an analysis, in the order they are computed
+SECTIONS = ("sentiment", "tfidf", "topics", "network", "wordcloud", "cooccurrence_img")
+# Sections that are images; outside the legacy payload they are rendered by
+# the job queue and served from /artifacts
+IMAGE_SECTIONS = ("wordcloud", "cooccurrence_img")
+
+# Request parameters each section's output depends on; a section is cached
+# under these alone, so changing e.g. topic options reuses the other sections
+SECTION_PARAMS = {
+    "sentiment": ("sentiment_backend",),
+    "tfidf": ("lemmatize",),
+    "topics": ("lemmatize", "topic_scope") + tuple(TOPIC_PARAMS),
+    "network": ("lemmatize",) + tuple(GRAPH_PARAMS) + ("layout",),
+    "wordcloud": ("lemmatize",),
+    "cooccurrence_img": ("lemmatize",) + tuple(GRAPH_PARAMS) + ("layout",),
+}
+
+# Polarity histogram returned instead of one score per comment
+HISTOGRAM_EDGES = np.linspace(-1.0, 1.0, 21)
+
+
+# Convert any numpy types (e.g., int64, float64) to standard Python types (e.g., int, float)
+def convert_to_serializable(value):
+    if isinstance(value, (np.int64, np.float64)):
+        return value.item()  # Convert to native Python type (int or float)
+    elif isinstance(value, dict):
+        return {k: convert_to_serializable(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [convert_to_serializable(v) for v in value]
+    else:
+        return value
+
+
+def section_params(section, params):
+    return {k: v for k, v in params.items() if k in SECTION_PARAMS.get(section, ())}
+
+
+def _report(progress, stage, fraction):
+    if progress is not None:
+        progress(stage, fraction)
+
+
+class AnalysisContext:
+    """Intermediates shared by the sections of one analysis.
+
+    Each is computed on first use and kept for the rest of the request, so
+    e.g. the network and its image share one co-occurrence count, and the
+    file is streamed once whatever sections are asked for.
+    """
+
+    def __init__(self, blob, sections, progress=None, fs=None, lemmatize=False, sentiment_backend="textblob",
+                 sentiment_scores=False, topic_scope="file", topic_max_iter=10,
+                 topic_evaluate_every=0, topic_tol=0.1, topic_n_jobs=1, topic_store=None,
+                 graph_nodes=100, graph_min_weight=1, graph_min_pmi=None, graph_top_k=0,
+                 graph_max_edges=GRAPH_MAX_EDGES, graph_window=0, graph_binary=0, layout="auto",
+                 positions=None):
+        self.blob = blob
+        # An incrementally scraped file is read through all its segments when
+        # fs is given to look them up
+        self.segments = segment_chain(fs, blob) if fs is not None else [blob]
+        self.sections = set(sections)
+        self.progress = progress
+        self.lemmatize = lemmatize
+        self.sentiment_backend = sentiment_backend
+        self.sentiment_scores = sentiment_scores
+        self.topic_scope = topic_scope
+        self.topic_store = topic_store
+        self.lda_options = dict(max_iter=topic_max_iter, evaluate_every=topic_evaluate_every,
+                                tol=topic_tol, n_jobs=topic_n_jobs)
+        self.graph_nodes = graph_nodes
+        self.pair_options = dict(window=graph_window or None, binary=bool(graph_binary))
+        self.graph_options = dict(graph_min_weight=graph_min_weight, graph_min_pmi=graph_min_pmi,
+                                  graph_top_k=graph_top_k, graph_max_edges=graph_max_edges)
+        self.layout = layout
+        # Layout coordinates already computed for the network section, if known
+        self._positions = positions
+
+    @cached_property
+    def streamed(self):
+        # Sentiment is scored chunk by chunk while the file streams in. When a
+        # corpus-level section is asked for, each chunk is also tokenized into
+        # the shared corpus, so no stage splits the texts again; with
+        # ANALYSIS_MAX_TEXTS set, a sample of the texts is tokenized at the
+        # end instead. Raises ValueError without a text column.
+        _, chunks = open_segment_chunks(self.segments)
+        scoring = "sentiment" in self.sections
+        corpus = Corpus(self.lemmatize) if self.sections - {"sentiment"} else None
+        sample = TextSample() if corpus is not None and MAX_TEXTS else None
+        scores = [] if self.sentiment_scores else None
+        summary = Counter()
+        histogram = np.zeros(len(HISTOGRAM_EDGES) - 1, dtype=np.int64)
+        total = 0.0
+        length = sum(segment.length for segment in self.segments)
+        for chunk in timed_iter("load", chunks):
+            if scoring:
+                with timed("sentiment"):
+                    chunk_scores = score_texts(chunk, backend=self.sentiment_backend)
+                    summary.update(label(s) for s in chunk_scores)
+                    histogram += np.histogram(np.clip(chunk_scores, -1.0, 1.0), bins=HISTOGRAM_EDGES)[0]
+                    total += sum(chunk_scores)
+                if scores is not None:
+                    scores.extend(chunk_scores)
+            if sample is not None:
+                sample.extend(chunk)
+            elif corpus is not None:
+                with timed("tokenize"):
+                    corpus.add(chunk)
+            if length:
+                _report(self.progress, "sentiment" if scoring else "load",
+                        0.4 * sum(segment.tell() for segment in self.segments) / length)
+        if sample is not None:
+            with timed("tokenize"):
+                corpus.add(sample.texts)
+        return {
+            "corpus": corpus if corpus is not None else Corpus(),
+            "scores": scores,
+            "summary": summary,
+            "histogram": histogram,
+            "mean": total / sum(summary.values()) if summary else 0.0,
+        }
+
+    @property
+    def corpus(self):
+        return self.streamed["corpus"]
+
+    @cached_property
+    def term_counts(self):
+        # (words, counts), shared by TF-IDF and topics
+        corpus = self.corpus
+        with timed("term_matrix"):
+            return count_matrix(corpus)
+
+    @cached_property
+    def graph(self):
+        corpus = self.corpus
+        with timed("cooccurrence"):
+            vocab, counts = cooccurrence_matrix(corpus, top_n=self.graph_nodes, **self.pair_options)
+            return CooccurrenceGraph(vocab, counts, **self.graph_options)
+
+    @cached_property
+    def positions(self):
+        # Computed once and shared by the network payload and its image
+        if self._positions:
+            return self._positions
+        graph = self.graph
+        with timed("layout"):
+            return graph.layout(self.layout)
+
+    def image(self, section, image_format="png"):
+        if section == "wordcloud":
+            corpus = self.corpus
+            with timed("render_wordcloud"):
+                frequencies = dict(zip(corpus.vocab, corpus.frequencies().tolist()))
+                return render_wordcloud(frequencies, image_format)
+        graph, positions = self.graph, self.positions
+        with timed("render_graph"):
+            return render_graph(graph.to_networkx(), positions, image_format)
+
+
+def _sentiment_section(ctx):
+    streamed = ctx.streamed
+    out = {
+        "sentiment_summary": dict(streamed["summary"]),
+        "sentiment_histogram": {
+            "edges": HISTOGRAM_EDGES.round(2).tolist(),
+            "counts": streamed["histogram"].tolist(),
+        },
+        "sentiment_mean": streamed["mean"],
+    }
+    if streamed["scores"] is not None:
+        out["sentiments"] = streamed["scores"]
+    return out
+
+
+def _tfidf_section(ctx):
+    words, counts = ctx.term_counts
+    return {"tfidf": top_tfidf(words, counts)}
+
+
+def _segment_corpus(segment, lemmatize):
+    segment.seek(0)
+    _, chunks = open_text_chunks(segment)
+    corpus = Corpus(lemmatize)
+    for chunk in chunks:
+        corpus.add(chunk)
+    return corpus
+
+
+def _topics_section(ctx):
+    topics = None
+    if ctx.topic_scope == "query" and ctx.topic_store is not None:
+        segments = None
+        if len(ctx.segments) > 1:
+            segments = [(str(segment._id), lambda segment=segment: _segment_corpus(segment, ctx.lemmatize))
+                        for segment in ctx.segments]
+        topics = ctx.topic_store.topics(str(ctx.blob._id), ctx.corpus, segments=segments, **ctx.lda_options)
+    if topics is None:
+        topics = fit_topics(*ctx.term_counts, **ctx.lda_options)
+    return {"topics": topics}
+
+
+def network_payload(graph, positions):
+    """The network section's fields for a CooccurrenceGraph and its layout."""
+    def top(centralities):
+        return sorted(centralities.items(), key=lambda x: x[1], reverse=True)[:10]
+
+    return {
+        "network": {
+            'nodes': [{'id': node, 'x': x, 'y': y} for node, (x, y) in positions.items()],
+            'edges': [{'source': u, 'target': v, 'weight': w} for u, v, w in graph.edges()]
+        },
+        "centralities": top(graph.degree_centrality()),
+        "weighted_centralities": top(graph.weighted_centrality()),
+    }
+
+
+def _network_section(ctx):
+    return network_payload(ctx.graph, ctx.positions)
+
+
+def _wordcloud_section(ctx):
+    return {"wordcloud": base64.b64encode(ctx.image("wordcloud")).decode('utf-8')}
+
+
+def _cooccurrence_img_section(ctx):
+    return {"cooccurrence_img": base64.b64encode(ctx.image("cooccurrence_img")).decode('utf-8')}
+
+
+SECTION_BUILDERS = {
+    "sentiment": _sentiment_section,
+    "tfidf": _tfidf_section,
+    "topics": _topics_section,
+    "network": _network_section,
+    "wordcloud": _wordcloud_section,
+    "cooccurrence_img": _cooccurrence_img_section,
+}
+# Progress fraction reported as each section starts, after the 40% taken by streaming
+SECTION_PROGRESS = {"sentiment": 0.4, "tfidf": 0.4, "topics": 0.5, "network": 0.7,
+                    "wordcloud": 0.8, "cooccurrence_img": 0.9}
+
+
+def run_sections(blob, sections, progress=None, **options):
+    """Computes only the requested sections; returns {section: fields} or {"error": ...}.
+
+    options are AnalysisContext's keyword arguments.
+    """
+    ctx = AnalysisContext(blob, sections, progress=progress, **options)
+    _report(progress, "load", 0.0)
+    try:
+        ctx.streamed
+    except ValueError as e:
+        return {"error": str(e)}
+
+    parts = {}
+    for section in SECTIONS:
+        if section in ctx.sections:
+            _report(progress, section, SECTION_PROGRESS[section])
+            with timed(f"section_{section}"):
+                parts[section] = SECTION_BUILDERS[section](ctx)
+    _report(progress, "done", 1.0)
+    return parts
+
+
+def render_image(blob, section, image_format="png", progress=None, **options):
+    """One image section as bytes in image_format, for storing as an artifact."""
+    ctx = AnalysisContext(blob, [section], progress=progress, **options)
+    _report(progress, "load", 0.0)
+    ctx.streamed
+    _report(progress, section, 0.5)
+    return ctx.image(section, image_format)
+
+
+# The full legacy payload: every section, with one sentiment score per comment.
+# progress, when given, is called as progress(stage, fraction) before each stage.
+# topic_store (a topics.TopicModelStore) is needed for topic_scope="query".
+def run_analysis(blob, progress=None, **options):
+    parts = run_sections(blob, SECTIONS, progress=progress, sentiment_scores=True, **options)
+    if "error" in parts:
+        return parts
+    result = {}
+    for part in parts.values():
+        result.update(part)
+    return result
@@ -0,0 +1,135 @@
+import os
+import re
+from array import array
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+
+# Words of two or more letters; digits and underscores split words
+TOKEN_RE = re.compile(r"[^\W\d_]{2,}")
+
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", 1000))
+# Worker processes for nlp.pipe; each loads its own copy of the model
+SPACY_PROCESSES = int(os.getenv("SPACY_PROCESSES", 1))
+
+
+def preprocess_params(args):
+    """Non-default preprocessing options from request args; raises ValueError when invalid."""
+    if args.get("lemmatize", "").lower() not in ("1", "true", "yes"):
+        return {}
+    load_spacy()
+    return {"lemmatize": True}
+
+
+@lru_cache(maxsize=1)
+def load_spacy():
+    import spacy
+
+    try:
+        # Only the tagger and lemmatizer are needed
+        return spacy.load(SPACY_MODEL, disable=["parser", "ner"])
+    except OSError:
+        raise ValueError(f"lemmatize needs the spaCy model {SPACY_MODEL}, which is not installed")
+
+
+@lru_cache(maxsize=1)
+def stop_words():
+    # sklearn's English list; importing sklearn takes a second or two, so it
+    # waits for the first text
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    return frozenset(ENGLISH_STOP_WORDS)
+
+
+def tokenize(text):
+    """Lowercased words of a text, stop words removed."""
+    stop = stop_words()
+    return [w for w in TOKEN_RE.findall(text.lower()) if w not in stop]
+
+
+def _lemmatized(texts):
+    stop = stop_words()
+    docs = load_spacy().pipe(texts, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_PROCESSES)
+    for doc in docs:
+        yield [w for w in (t.lemma_.lower() for t in doc if t.is_alpha)
+               if len(w) > 1 and w not in stop]
+
+
+class Corpus:
+    """Texts tokenized once, as token ids into a shared vocabulary.
+
+    Every corpus-level stage (TF-IDF, topics, the co-occurrence network and
+    the word cloud) reads these instead of splitting the texts again. Token
+    ids are kept in one flat array with each text's start offset, so a
+    corpus costs a few bytes per token rather than a list of strings per
+    text.
+    """
+
+    def __init__(self, lemmatize=False):
+        self.lemmatize = lemmatize
+        self.vocab = []
+        self._index = {}
+        self._ids = array("q")
+        self._offsets = array("q", [0])
+
+    def add(self, texts):
+        tokens = _lemmatized(texts) if self.lemmatize else map(tokenize, texts)
+        index, vocab, ids = self._index, self.vocab, self._ids
+        for words in tokens:
+            for w in words:
+                i = index.get(w)
+                if i is None:
+                    i = index[w] = len(vocab)
+                    vocab.append(w)
+                ids.append(i)
+            self._offsets.append(len(ids))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def ids(self):
+        return np.frombuffer(self._ids, dtype=np.int64)
+
+    @property
+    def offsets(self):
+        return np.frombuffer(self._offsets, dtype=np.int64)
+
+    def frequencies(self):
+        """Occurrences of each vocabulary word over the corpus."""
+        return np.bincount(self.ids, minlength=len(self.vocab))
+
+    def term_matrix(self, max_features=None, vocabulary=None):
+        """(words, document-term counts) as CountVectorizer would give them.
+
+        max_features keeps the most frequent words; a fixed vocabulary keeps
+        columns aligned with a stored model, dropping words outside it.
+        """
+        if vocabulary is not None:
+            words = list(vocabulary)
+        else:
+            kept = range(len(self.vocab))
+            if max_features is not None and len(self.vocab) > max_features:
+                kept = np.argsort(-self.frequencies(), kind="stable")[:max_features]
+            # Alphabetical columns, as CountVectorizer orders them
+            words = sorted(self.vocab[i] for i in kept)
+        position = {w: j for j, w in enumerate(words)}
+        columns = np.array([position.get(w, -1) for w in self.vocab], dtype=np.int64)
+
+        cols = columns[self.ids]
+        keep = cols >= 0
+        docs = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        counts = sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype=np.int64), (docs[keep], cols[keep])),
+            shape=(len(self), len(words)),
+        )
+        counts.sum_duplicates()
+        return np.asarray(words, dtype=object), counts
+
+
+def preprocess(texts, lemmatize=False):
+    corpus = Corpus(lemmatize)
+    corpus.add(texts)
+    return corpus
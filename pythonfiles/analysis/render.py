@@ -0,0 +1,84 @@
+from functools import lru_cache
+from io import BytesIO
+
+import gridfs
+import networkx as nx
+
+import datastore
+
+IMAGE_FORMATS = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml"}
+
+
+@lru_cache(maxsize=1)
+def _use_agg():
+    # Set before anything imports pyplot (networkx's drawing does), so no
+    # process ever probes for a GUI backend
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def render_wordcloud(frequencies, image_format="png"):
+    _use_agg()
+    from wordcloud import WordCloud
+
+    # Drawn from the corpus' word counts, so WordCloud does not tokenize the texts again
+    wordcloud = WordCloud(width=800, height=400, background_color='white').generate_from_frequencies(frequencies)
+    if image_format == "svg":
+        return wordcloud.to_svg().encode()
+    out = BytesIO()
+    wordcloud.to_image().save(out, format=image_format.upper())
+    return out.getvalue()
+
+
+def render_graph(G, pos, image_format="png"):
+    _use_agg()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    # A Figure with its own Agg canvas rather than pyplot, whose global figure
+    # state is shared by every thread in the process
+    fig = Figure(figsize=(10, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    nx.draw_networkx_nodes(G, pos, node_size=600, node_color='lightblue', ax=ax)
+    nx.draw_networkx_edges(G, pos, width=[G[u][v]['weight'] * 0.1 for u, v in G.edges()], alpha=0.6, ax=ax)
+    nx.draw_networkx_labels(G, pos, font_size=10, ax=ax)
+    ax.set_title(" ", fontsize=14)
+    ax.axis('off')
+
+    out = BytesIO()
+    if image_format == "webp":
+        # Agg writes PNG; Pillow re-encodes it
+        from PIL import Image
+
+        png = BytesIO()
+        fig.savefig(png, format="png", bbox_inches='tight')
+        Image.open(png).save(out, format="WEBP", lossless=True)
+    else:
+        fig.savefig(out, format=image_format, bbox_inches='tight')
+    return out.getvalue()
+
+
+class ArtifactStore:
+    """Rendered images in their own GridFS bucket, addressed by cache key.
+
+    The key covers the file's content, the pipeline version and the render
+    options, so a stored artifact never changes and can be cached by clients
+    indefinitely.
+    """
+
+    def __init__(self, db, collection="artifacts"):
+        self.fs = gridfs.GridFS(db, collection=collection)
+        datastore.at_first_request(db[f"{collection}.files"].create_index, "metadata.key")
+        datastore.at_first_request(db[f"{collection}.files"].create_index, "metadata.blob_id")
+
+    def get(self, key):
+        return self.fs.find_one({"metadata.key": key})
+
+    def put(self, key, blob_id, data, content_type):
+        return self.fs.put(data, filename=key, metadata={
+            "key": key,
+            "blob_id": blob_id,
+            "content_type": content_type,
+        })
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import bson
+
+import datastore
+from metrics import count, timed
+
+# Bump whenever the analysis pipeline changes in a way that alters its output,
+# so results computed by an older version are never served.
+ANALYSIS_VERSION = "6"
+
+CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_SIZE", 32))
+CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL", 24 * 3600))
+# Stay well below MongoDB's 16MB document limit
+CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+
+# Parameters that only change how a result is computed, not the result
+RUNTIME_PARAMS = ("topic_n_jobs",)
+
+
+def cache_key(blob, params=None):
+    # GridFS files are immutable, so the md5 (when the driver recorded one) or
+    # the ObjectId identifies the content; the version covers the pipeline.
+    # An entry therefore never goes stale, and needs no invalidating: once its
+    # file is deleted nothing can reach it, as every route resolves the file
+    # (or the job's file) before reading the cache. main.py still deletes the
+    # file's entries from MongoDB to free the space.
+    ident = getattr(blob, "md5", None) or str(blob._id)
+    params = {k: v for k, v in (params or {}).items() if k not in RUNTIME_PARAMS}
+    if params.get("topic_scope") == "query" or (blob.metadata or {}).get("previous_blob_id"):
+        # Query topic models depend on whose scrape this is (their revision
+        # comes in params, see analysis.result_key), and the newest segment
+        # of an incremental scrape stands for its whole chain, so neither is
+        # identified by its own content
+        ident = str(blob._id)
+    raw = f"{ident}:{ANALYSIS_VERSION}"
+    if params:
+        raw += ":" + json.dumps(params, sort_keys=True)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class LRUCache:
+    """In-process tier: bounded by entry count, entries expire after ttl seconds."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class MongoCache:
+    """Shared tier in a MongoDB collection; entries expire ttl seconds after they are written.
+
+    main.py deletes from the same collection when a file is removed.
+    """
+
+    def __init__(self, collection, ttl=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES):
+        self.col = collection
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        datastore.at_first_request(datastore.ensure_expiry_index, self.col)
+        datastore.at_first_request(self.col.create_index, "blob_id")
+
+    def get(self, key):
+        with timed("cache_read"):
+            doc = self.col.find_one({"_id": key}, {"result": 1})
+        return doc["result"] if doc else None
+
+    def set(self, key, blob_id, result):
+        now = datetime.now(timezone.utc)
+        doc = {
+            "_id": key,
+            "blob_id": blob_id,
+            "version": ANALYSIS_VERSION,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl),
+            "result": result,
+        }
+        if len(bson.encode(doc)) > self.max_bytes:
+            count("cache_too_large")
+            return False
+        with timed("cache_write"):
+            self.col.replace_one({"_id": key}, doc, upsert=True)
+        return True
+
+
+class ResultCache:
+    def __init__(self, memory, store=None):
+        self.memory = memory
+        self.store = store
+
+    def get(self, key):
+        result = self.memory.get(key)
+        if result is not None or self.store is None:
+            count("cache_memory_hit" if result is not None else "cache_miss")
+            return result
+        result = self.store.get(key)
+        if result is None:
+            count("cache_miss")
+            return None
+        count("cache_store_hit")
+        # Promote so the next hit on this worker skips the round trip
+        self.memory.set(key, result)
+        return result
+
+    # Returns whether the result reached the shared tier
+    def set(self, key, blob_id, result):
+        self.memory.set(key, result)
+        if self.store is None:
+            return False
+        return self.store.set(key, blob_id, result)
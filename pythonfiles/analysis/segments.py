@@ -0,0 +1,20 @@
+# Shared by both services: analysis/ and main/ each hold an identical copy,
+# as each deploys from its own directory. Edit both together;
+# benchmarks/check_shared_modules.py fails when they differ.
+
+
+def segment_chain(fs, blob):
+    """The segments of a dataset, oldest first.
+
+    Incremental scrapes store each run's new rows as a segment whose
+    metadata links to the previous one; blob is the newest.
+    """
+    chain = [blob]
+    seen = {blob._id}
+    while (chain[-1].metadata or {}).get("previous_blob_id") is not None:
+        previous = chain[-1].metadata["previous_blob_id"]
+        if previous in seen:
+            break
+        seen.add(previous)
+        chain.append(fs.get(previous))
+    return chain[::-1]
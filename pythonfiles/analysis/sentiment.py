@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import numpy as np
+
+BACKENDS = ("textblob", "lexicon")
+
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", os.cpu_count() or 1))
+SENTIMENT_CHUNK_SIZE = int(os.getenv("SENTIMENT_CHUNK_SIZE", 2000))
+# Below this many distinct texts, starting workers and pickling chunks costs
+# more than scoring serially
+SENTIMENT_PARALLEL_MIN = int(os.getenv("SENTIMENT_PARALLEL_MIN", 5000))
+
+
+def label(score):
+    return 'positive' if score > 0.05 else 'negative' if score < -0.05 else 'neutral'
+
+
+def score_texts(texts, backend="textblob", workers=None):
+    """Polarity in [-1, 1] for each text, in order.
+
+    Identical texts (spam, copy-paste replies) are scored once.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown sentiment backend: {backend}")
+    unique = list(dict.fromkeys(texts))
+    if backend == "lexicon":
+        scores = _lexicon_scores(unique)
+    else:
+        scores = _textblob_scores(unique, workers or SENTIMENT_WORKERS)
+    lookup = dict(zip(unique, scores))
+    return [lookup[t] for t in texts]
+
+
+def disable_parallelism():
+    # For processes that are themselves one of a pool of workers
+    global SENTIMENT_WORKERS
+    SENTIMENT_WORKERS = 1
+
+
+# --- TextBlob backend ---
+
+@lru_cache(maxsize=50_000)
+def _polarity(text):
+    # Imported on first use, as TextBlob (and NLTK under it) takes seconds to load
+    from textblob import TextBlob
+
+    return TextBlob(text).sentiment.polarity
+
+
+def _score_chunk(chunk):
+    return [_polarity(t) for t in chunk]
+
+
+_pool = None
+
+
+def _get_pool(workers):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _textblob_scores(texts, workers):
+    global _pool
+    if workers <= 1 or len(texts) < SENTIMENT_PARALLEL_MIN:
+        return _score_chunk(texts)
+    chunks = [texts[i:i + SENTIMENT_CHUNK_SIZE] for i in range(0, len(texts), SENTIMENT_CHUNK_SIZE)]
+    pool = _get_pool(workers)
+    try:
+        return [score for part in pool.map(_score_chunk, chunks) for score in part]
+    except BrokenProcessPool:
+        # A worker died; shut the broken pool down so its management thread and
+        # any surviving workers exit, start a fresh one next time and finish
+        # this batch here
+        if _pool is pool:
+            _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        return _score_chunk(texts)
+
+
+# --- Lexicon backend ---
+#
+# Averages the polarity of every word found in TextBlob's own lexicon, as one
+# sparse matrix product over all texts. It skips TextBlob's negation and
+# intensifier rules, so scores are close to but not identical with the
+# default backend; labels use the same thresholds.
+
+_lexicon = None
+
+
+def _get_lexicon():
+    global _lexicon
+    if _lexicon is None:
+        from sklearn.feature_extraction.text import CountVectorizer
+        from textblob.en import sentiment as pattern_lexicon
+
+        words = [w for w in pattern_lexicon if " " not in w]
+        polarity = np.array([pattern_lexicon[w][None][0] for w in words])
+        vectorizer = CountVectorizer(vocabulary=words, token_pattern=r"(?u)\b\w[\w']*\b")
+        _lexicon = (vectorizer, polarity)
+    return _lexicon
+
+
+def _lexicon_scores(texts):
+    if not texts:
+        return []
+    vectorizer, polarity = _get_lexicon()
+    X = vectorizer.transform(texts)
+    hits = np.asarray(X.sum(axis=1)).ravel()
+    totals = X @ polarity
+    scores = np.divide(totals, hits, out=np.zeros(len(texts)), where=hits > 0)
+    return scores.tolist()
@@ -0,0 +1,195 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from scipy import sparse
+
+import datastore
+from options import numeric_params
+
+N_TOPICS = 5
+TOP_WORDS = 10
+MAX_FEATURES = 1000
+# "file" fits a model on the analysed file alone; "query" folds the file into
+# a model kept for everything the user scraped under the same query
+SCOPES = ("file", "query")
+# Online updates weigh each new file as part of a corpus of about this many documents
+TOPIC_TOTAL_SAMPLES = int(os.getenv("TOPIC_TOTAL_SAMPLES", 100000))
+# Concurrent updates to the same query model are retried this many times
+MODEL_UPDATE_RETRIES = 3
+
+# Request parameter -> (type, default, minimum, maximum)
+TOPIC_PARAMS = {
+    "topic_max_iter": (int, 10, 1, 500),
+    # Perplexity is checked every this many iterations and fitting stops once it
+    # improves by less than topic_tol; 0 always runs topic_max_iter iterations
+    "topic_evaluate_every": (int, 0, 0, 100),
+    "topic_tol": (float, 0.1, 0.0, 1000.0),
+    "topic_n_jobs": (int, 1, -1, os.cpu_count() or 1),
+}
+
+
+def topic_params(args):
+    """Non-default topic options from request args; raises ValueError when invalid."""
+    params = {}
+    scope = args.get("topic_scope", "file")
+    if scope not in SCOPES:
+        raise ValueError(f"topic_scope must be one of {', '.join(SCOPES)}")
+    if scope != "file":
+        params["topic_scope"] = scope
+    params.update(numeric_params(args, TOPIC_PARAMS))
+    if params.get("topic_n_jobs") == 0:
+        raise ValueError("topic_n_jobs must be -1 or a positive number")
+    return params
+
+
+def count_matrix(corpus, vocabulary=None):
+    """(words, document-term counts) of a preprocess.Corpus; a fixed vocabulary
+    keeps columns aligned with a stored model."""
+    if vocabulary is not None:
+        return corpus.term_matrix(vocabulary=vocabulary)
+    return corpus.term_matrix(max_features=MAX_FEATURES)
+
+
+def top_tfidf(words, counts, top_n=20):
+    # Same weights TfidfVectorizer gives, without tokenizing the texts again
+    from sklearn.feature_extraction.text import TfidfTransformer
+
+    scores = TfidfTransformer().fit_transform(counts).sum(axis=0).A1
+    return sorted(zip(words, scores), key=lambda x: x[1], reverse=True)[:top_n]
+
+
+def _new_model(learning_method, max_iter, evaluate_every, tol, n_jobs):
+    from sklearn.decomposition import LatentDirichletAllocation
+
+    return LatentDirichletAllocation(
+        n_components=N_TOPICS, random_state=42, learning_method=learning_method,
+        max_iter=max_iter, evaluate_every=evaluate_every or -1, perp_tol=tol,
+        n_jobs=n_jobs, total_samples=TOPIC_TOTAL_SAMPLES,
+    )
+
+
+def top_words(lda, words):
+    return [[words[i] for i in topic.argsort()[-TOP_WORDS:]] for topic in lda.components_]
+
+
+def _model_fields(lda):
+    # The state partial_fit carries on from, stored as plain arrays and
+    # counts, which load back under any scikit-learn version
+    return {
+        "components": lda.components_.tolist(),
+        "exp_dirichlet_component": lda.exp_dirichlet_component_.tolist(),
+        "n_batch_iter": int(lda.n_batch_iter_),
+    }
+
+
+def _load_model(doc, max_iter, evaluate_every, tol, n_jobs):
+    """Rebuilds a stored online model, as partial_fit would have left it."""
+    from sklearn.utils import check_random_state
+
+    lda = _new_model("online", max_iter, evaluate_every, tol, n_jobs)
+    lda.components_ = np.array(doc["components"], dtype=np.float64)
+    lda.exp_dirichlet_component_ = np.array(doc["exp_dirichlet_component"], dtype=np.float64)
+    lda.n_batch_iter_ = doc["n_batch_iter"]
+    lda.n_iter_ = 0
+    lda.n_features_in_ = lda.components_.shape[1]
+    # The defaults fit gives the priors, as _new_model sets neither
+    lda.doc_topic_prior_ = lda.topic_word_prior_ = 1.0 / N_TOPICS
+    lda.random_state_ = check_random_state(lda.random_state)
+    return lda
+
+
+def fit_topics(words, counts, max_iter=10, evaluate_every=0, tol=0.1, n_jobs=1):
+    lda = _new_model("batch", max_iter, evaluate_every, tol, n_jobs)
+    lda.fit(counts)
+    return top_words(lda, words)
+
+
+class TopicModelStore:
+    """Online LDA models persisted per (email, query).
+
+    The first file analysed for a query fixes the vocabulary and fits the
+    model; every later file is folded in with one partial_fit over its own
+    documents, so analysing a growing query corpus only costs the new file.
+    The ids of files already folded in are kept on the model so a file is
+    never counted twice; for an incrementally scraped file that is each of
+    its segments, so only the ones added since are folded in.
+    """
+
+    def __init__(self, collection, history_col):
+        self.col = collection
+        self.history = history_col
+        datastore.at_first_request(self.col.create_index, [("email", 1), ("query", 1)], unique=True)
+
+    def owner(self, blob_id):
+        entry = self.history.find_one({"csv_blob_id": ObjectId(blob_id)}, {"email": 1, "query": 1})
+        if entry is None:
+            return None
+        return entry.get("email"), entry.get("query", "")
+
+    def revision(self, blob_id):
+        """Revision of the query model this file folds into: 0 before the
+        query's first file, None when the file has no history entry."""
+        owner = self.owner(blob_id)
+        if owner is None:
+            return None
+        email, query = owner
+        doc = self.col.find_one({"email": email, "query": query}, {"revision": 1})
+        return doc["revision"] if doc else 0
+
+    def topics(self, blob_id, corpus, max_iter=10, evaluate_every=0, tol=0.1, n_jobs=1, segments=None):
+        """Topics of the query model after folding in this file, or None when
+        the file has no history entry to tie it to a query.
+
+        segments lists (segment_id, load_corpus) for a file stored as several
+        segments; corpus covers all of them.
+        """
+        segments = segments or [(blob_id, lambda: corpus)]
+        owner = self.owner(blob_id)
+        if owner is None:
+            return None
+        email, query = owner
+
+        for _ in range(MODEL_UPDATE_RETRIES):
+            doc = self.col.find_one({"email": email, "query": query})
+            if doc is None:
+                words, counts = count_matrix(corpus)
+                lda = _new_model("online", max_iter, evaluate_every, tol, n_jobs)
+                lda.fit(counts)
+                try:
+                    self.col.insert_one({
+                        "email": email,
+                        "query": query,
+                        "vocabulary": list(words),
+                        **_model_fields(lda),
+                        "blob_ids": [segment_id for segment_id, _ in segments],
+                        "documents": counts.shape[0],
+                        "revision": 1,
+                        "updated_at": datetime.now(timezone.utc),
+                    })
+                except DuplicateKeyError:
+                    continue
+                return top_words(lda, words)
+
+            lda = _load_model(doc, max_iter, evaluate_every, tol, n_jobs)
+            words = doc["vocabulary"]
+            new = [(segment_id, load) for segment_id, load in segments if segment_id not in doc["blob_ids"]]
+            if not new:
+                return top_words(lda, words)
+
+            if len(new) == len(segments):
+                _, counts = count_matrix(corpus, vocabulary=words)
+            else:
+                counts = sparse.vstack([count_matrix(load(), vocabulary=words)[1] for _, load in new])
+            lda.partial_fit(counts)
+            # Only applies if nobody else updated the model since it was read
+            saved = self.col.update_one({"_id": doc["_id"], "revision": doc["revision"]}, {
+                "$set": {**_model_fields(lda), "updated_at": datetime.now(timezone.utc)},
+                "$push": {"blob_ids": {"$each": [segment_id for segment_id, _ in new]}},
+                "$inc": {"documents": counts.shape[0], "revision": 1},
+            })
+            if saved.modified_count:
+                return top_words(lda, words)
+        raise RuntimeError("Topic model is being updated concurrently, try again shortly")
@@ -0,0 +1,87 @@
+import io
+import logging
+import threading
+import time
+
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+# What the warm-up analysis runs on: enough comments, sharing enough words,
+# for every section to do real work
+WARMUP_TEXTS = [
+    "Great video, the explanation of the data was really clear",
+    "I did not like the music but the data analysis was great",
+    "Terrible audio again, please fix the microphone",
+    "The analysis of the comments is clear and the charts are great",
+    "Why is the music so loud, I could not hear the explanation",
+    "Really helpful video, the charts made the data easy to follow",
+    "Please make another video about topic models and charts",
+    "The microphone sounds better now, great improvement",
+] * 4
+
+
+class _MemoryBlob(io.BytesIO):
+    # Just enough of a GridFS file for the pipeline to read
+    def __init__(self, data):
+        super().__init__(data)
+        self._id = "warm-up"
+        self.filename = "warm-up.csv"
+        self.length = len(data)
+        self.metadata = {"format": "csv", "text_column": "comment"}
+
+
+def warm_up():
+    """Runs every section once on a few comments.
+
+    The heavy libraries each stage imports on first use (pandas, TextBlob,
+    scikit-learn, matplotlib, WordCloud) get loaded, along with their data
+    files and matplotlib's font cache, so the first real request does not
+    wait on them.
+    """
+    from pipeline import SECTIONS, run_sections
+
+    data = "comment\n" + "\n".join(f'"{text}"' for text in WARMUP_TEXTS) + "\n"
+    parts = run_sections(_MemoryBlob(data.encode()), SECTIONS)
+    if "error" in parts:
+        raise ValueError(parts["error"])
+
+
+class Readiness:
+    """The warm-up's progress, for /healthz: "warming" until it has run.
+
+    A warm-up that fails still leaves the service ready, as requests only
+    lose its head start; the error is reported alongside.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.seconds = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._started = False
+
+    def run(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start = time.perf_counter()
+        try:
+            with timed("warm_up"):
+                warm_up()
+        except Exception as e:
+            log.warning("Warm-up failed: %s", e)
+            self.error = str(e)
+        self.seconds = time.perf_counter() - start
+        self.ready = True
+
+    def start(self):
+        """Warms up on a background thread, so the server can listen meanwhile."""
+        threading.Thread(target=self.run, name="warm-up", daemon=True).start()
+
+    def status(self):
+        status = {"status": "ready" if self.ready else "warming", "warm_up_seconds": self.seconds}
+        if self.error:
+            status["warm_up_error"] = self.error
+        return status
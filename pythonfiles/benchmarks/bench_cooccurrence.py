@@ -0,0 +1,83 @@
+"""Compare the sparse co-occurrence builder with the original per-pair graph loop.
+
+    python bench_cooccurrence.py --sizes 10000 100000 1000000 --legacy-max 100000
+
+The legacy loop is quadratic per comment, so by default it only runs up to
+--legacy-max rows; pass a larger value to time it on the full range. Both
+run on the shared preprocessing's tokens so their graphs can be compared.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+
+import networkx as nx
+
+from cooccurrence import cooccurrence_matrix, degree_centrality
+from corpus import synthetic_comments
+from preprocess import preprocess, tokenize
+
+
+def legacy_graph(texts):
+    all_words = [word for text in texts for word in tokenize(text)]
+    common_words = [word for word, _ in Counter(all_words).most_common(100)]
+    G = nx.Graph()
+    for text in texts:
+        words = [w for w in tokenize(text) if w in common_words]
+        for i in range(len(words)):
+            for j in range(i + 1, len(words)):
+                if G.has_edge(words[i], words[j]):
+                    G[words[i]][words[j]]['weight'] += 1
+                else:
+                    G.add_edge(words[i], words[j], weight=1)
+    nx.degree_centrality(G)
+    return G
+
+
+def build_graph(vocab, counts):
+    # The sparse counts as a networkx graph, to compare with the legacy one
+    coo = counts.tocoo()
+    G = nx.Graph()
+    G.add_weighted_edges_from(
+        (vocab[i], vocab[j], int(w)) for i, j, w in zip(coo.row, coo.col, coo.data)
+    )
+    return G
+
+
+def sparse_graph(texts, window=None):
+    vocab, counts = cooccurrence_matrix(preprocess(texts), top_n=100, window=window)
+    degree_centrality(vocab, counts)
+    return build_graph(vocab, counts)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-max", type=int, default=100_000)
+    parser.add_argument("--window", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy s':>10} {'sparse s':>10} {'window s':>10} {'speedup':>8}")
+    for n in args.sizes:
+        texts = list(synthetic_comments(n))
+        sparse_s, G = timed(sparse_graph, texts)
+        window_s, _ = timed(sparse_graph, texts, window=args.window)
+        if n <= args.legacy_max:
+            legacy_s, legacy = timed(legacy_graph, texts)
+            assert legacy.number_of_edges() == G.number_of_edges()
+            print(f"{n:>10} {legacy_s:>10.2f} {sparse_s:>10.2f} {window_s:>10.2f} {legacy_s / sparse_s:>7.1f}x")
+        else:
+            print(f"{n:>10} {'-':>10} {sparse_s:>10.2f} {window_s:>10.2f} {'-':>8}")
+
+
+if __name__ == "__main__":
+    main()
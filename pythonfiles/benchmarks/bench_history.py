@@ -0,0 +1,158 @@
+"""Time the scrape history listing with many user_history entries.
+
+    python bench_history.py --rows 100000 --users 1000
+    python bench_history.py --uri mongodb://localhost:27017
+
+Compares the original /user-history work with the indexed, projected query
+it is now. The original scanned the user's entries, read and keyword-counted
+every blob and sorted in Python. Without --uri everything runs on mongomock,
+which has no query planner, so only the blob reads show up. Against a real
+mongod the winning plan is printed as well. A scratch database is used and
+dropped afterwards.
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+import gridfs
+
+import datastore
+import history_stats
+from corpus import synthetic_comments
+
+BENCH_DB = "SocialAnalysisBench"
+
+
+def legacy_keyword_count(blob):
+    content = blob.read().decode('utf-8')
+    keywords = ["data", "social", "sentiment"]
+    keyword_count = {keyword: 0 for keyword in keywords}
+    for row in content.splitlines():
+        for keyword in keywords:
+            if keyword.lower() in row.lower():
+                keyword_count[keyword] += 1
+    return keyword_count
+
+
+def legacy_history(col, fs, email):
+    formatted = []
+    for item in col.find({"email": email}):
+        blob = fs.get(item["csv_blob_id"])
+        formatted.append({
+            "platform": item.get("platform", ""),
+            "query": item.get("query", ""),
+            "csv_blob_id": str(blob._id),
+            "filename": blob.filename,
+            "uploaded_at": blob.upload_date.strftime("%Y-%m-%d %H:%M:%S"),
+            "file_size": blob.length,
+            "keyword_count": legacy_keyword_count(blob),
+        })
+    return sorted(formatted, key=lambda x: x["uploaded_at"], reverse=True)
+
+
+def indexed_history(col, email):
+    keywords = history_stats.DEFAULT_KEYWORDS
+    history = col.find({"email": email}, history_stats.HISTORY_FIELDS).sort("upload_time", -1)
+    return [history_stats.format_entry(item, keywords) for item in history]
+
+
+def csv_blob(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(["video_id", "author_name", "comment"])
+    writer.writerows([f"vid{i % 20}", f"user{i}", text] for i, text in enumerate(synthetic_comments(rows)))
+    return buf.getvalue().encode()
+
+
+def populate(db, rows, users, file_rows):
+    """Fills user_history; only user0's entries get real blobs, as only they are listed."""
+    fs = gridfs.GridFS(db)
+    data = csv_blob(file_rows)
+    counter = history_stats.KeywordCounter(history_stats.DEFAULT_KEYWORDS)
+    counter.update(list(csv.reader(io.StringIO(data.decode())))[1:])
+    start = datetime(2024, 1, 1)
+    rng = random.Random(42)
+    batch = []
+    for i in range(rows):
+        email = f"user{i % users}@example.com"
+        entry = {
+            "email": email,
+            "platform": "youtube",
+            "query": f"query {i % 37}",
+            "filename": f"scrape_{i}.csv",
+            "file_size": len(data),
+            "upload_time": start + timedelta(minutes=rng.randrange(500000)),
+            "row_count": file_rows,
+            "keyword_count": counter.counts,
+        }
+        entry["csv_blob_id"] = fs.put(data, filename=entry["filename"]) if i % users == 0 else None
+        batch.append(entry)
+        if len(batch) == 5000:
+            db["user_history"].insert_many(batch)
+            batch = []
+    if batch:
+        db["user_history"].insert_many(batch)
+    return fs
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--file-rows", type=int, default=2000, help="comments per scraped file")
+    parser.add_argument("--uri", help="a MongoDB to run against instead of mongomock")
+    args = parser.parse_args()
+
+    if args.uri:
+        client, _ = datastore.connect(args.uri)
+    else:
+        import mongomock
+        import mongomock.gridfs
+
+        mongomock.gridfs.enable_gridfs_integration()
+        client = mongomock.MongoClient()
+    db = client[BENCH_DB]
+    try:
+        datastore.ensure_indexes(db)
+        start = time.perf_counter()
+        fs = populate(db, args.rows, args.users, args.file_rows)
+        print(f"populated {args.rows} entries in {time.perf_counter() - start:.1f}s")
+
+        col = db["user_history"]
+        email = "user0@example.com"
+        legacy_s, legacy = timed(legacy_history, col, fs, email, repeat=1)
+        indexed_s, indexed = timed(indexed_history, col, email)
+        assert sorted(e["csv_blob_id"] for e in legacy) == sorted(e["csv_blob_id"] for e in indexed)
+        print(f"{'entries':>8} {'legacy s':>10} {'indexed s':>10} {'speedup':>8}")
+        print(f"{len(indexed):>8} {legacy_s:>10.3f} {indexed_s:>10.4f} {legacy_s / indexed_s:>7.0f}x")
+
+        if args.uri:
+            plan = col.find({"email": email}, history_stats.HISTORY_FIELDS).sort("upload_time", -1).explain()
+            stage = plan["queryPlanner"]["winningPlan"]
+            stages = []
+            while stage:
+                stages.append(stage.get("stage") + (f" {stage['indexName']}" if "indexName" in stage else ""))
+                stage = stage.get("inputStage")
+            print("plan:", " <- ".join(stages))
+    finally:
+        client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    main()
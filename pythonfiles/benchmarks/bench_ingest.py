@@ -0,0 +1,111 @@
+"""Peak memory of loading a scrape's text column: whole-file read vs streaming.
+
+    python bench_ingest.py --rows 100000 1000000
+
+Each measurement runs in a fresh interpreter and reports its peak RSS. The
+CSV is read from a file on disk in GridFS-sized pieces, standing in for a
+GridOut, so the legacy path pays for the full in-memory copy just as it does
+against MongoDB.
+"""
+import argparse
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "analysis"))
+
+from corpus import synthetic_comments
+
+MODES = ("legacy", "stream", "stream-count")
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["video_id", "author_name", "comment", "published_at", "likes", "reply_count"])
+        for i, text in enumerate(synthetic_comments(rows)):
+            writer.writerow([f"vid{i % 50}", f"user{i}", text, "2024-01-01T00:00:00Z", i % 7, i % 3])
+
+
+class FakeGridOut:
+    """File object with the GridOut surface the loaders use."""
+
+    def __init__(self, path):
+        self._f = open(path, "rb")
+        self.length = os.path.getsize(path)
+        self.metadata = None
+
+    def read(self, size=-1):
+        return self._f.read(size)
+
+    def seek(self, pos, whence=0):
+        return self._f.seek(pos, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def __iter__(self):
+        return iter(self._f)
+
+
+def run_child(mode, path):
+    import pandas as pd
+
+    from ingest import TextSample, find_text_column, open_text_chunks
+
+    blob = FakeGridOut(path)
+    start = time.perf_counter()
+    if mode == "legacy":
+        df = pd.read_csv(BytesIO(blob.read()))
+        texts = df[find_text_column(df.columns)].dropna().astype(str).tolist()
+        count = len(texts)
+    else:
+        _, chunks = open_text_chunks(blob)
+        sample = TextSample()
+        count = 0
+        for chunk in chunks:
+            count += len(chunk)
+            if mode == "stream":
+                sample.extend(chunk)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{count} {elapsed:.2f} {peak_mb:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--path")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.path)
+        return
+
+    # "stream" keeps every text, as the pipeline does for TF-IDF and topics;
+    # "stream-count" only consumes chunks, the bound for per-chunk stages
+    print(f"{'rows':>10} {'file MB':>8} " + " ".join(f"{m + ' MB':>16}" for m in MODES))
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = os.path.join(tmp, f"{rows}.csv")
+            write_csv(path, rows)
+            peaks = []
+            for mode in MODES:
+                out = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, "--path", path],
+                    check=True, capture_output=True, text=True,
+                ).stdout.split()
+                peaks.append(out[-1])
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            print(f"{rows:>10} {size_mb:>8.0f} " + " ".join(f"{p:>16}" for p in peaks))
+
+
+if __name__ == "__main__":
+    main()
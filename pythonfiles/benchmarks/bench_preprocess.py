@@ -0,0 +1,59 @@
+"""Tokenizing an analysis' texts once versus once per stage.
+
+    python bench_preprocess.py --sizes 10000 100000
+
+The per-stage path is what the pipeline did before the shared
+preprocessing: a CountVectorizer for TF-IDF and topics, another with the
+graph tokenizer for co-occurrence, and WordCloud's own tokenizer for the
+word cloud. The shared path builds one preprocess.Corpus and derives the
+same inputs from its token ids.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+
+from sklearn.feature_extraction.text import CountVectorizer
+from wordcloud import WordCloud
+
+from corpus import synthetic_comments
+from preprocess import preprocess
+from topics import MAX_FEATURES
+
+
+def per_stage(texts):
+    CountVectorizer(stop_words="english", max_features=MAX_FEATURES).fit_transform(texts)
+    CountVectorizer(analyzer=lambda t: [w for w in t.lower().split() if w.isalpha()]).fit_transform(texts)
+    WordCloud().process_text(" ".join(t.lower() for t in texts))
+
+
+def shared(texts):
+    corpus = preprocess(texts)
+    corpus.term_matrix(max_features=MAX_FEATURES)
+    corpus.term_matrix()
+    corpus.frequencies()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'per-stage s':>12} {'shared s':>10} {'speedup':>8}")
+    for n in args.sizes:
+        texts = list(synthetic_comments(n))
+        per_stage_s = timed(per_stage, texts)
+        shared_s = timed(shared, texts)
+        print(f"{n:>10} {per_stage_s:>12.2f} {shared_s:>10.2f} {per_stage_s / shared_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
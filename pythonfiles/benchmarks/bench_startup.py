@@ -0,0 +1,86 @@
+"""Startup time of both services, and the first analysis with and without the warm-up.
+
+    python bench_startup.py --repeat 5 --rows 1000
+
+Each measurement runs in a fresh interpreter, with MongoDB replaced by an
+in-memory one as in bench_suite. import is the time to import the app
+module, which every gunicorn worker pays without preload_app. warm-up is
+analysis.readiness.run(), paid once in the gunicorn master. first request
+is a sectioned /get-analysis on a synthetic scrape of --rows comments;
+"analysis cold" sends it straight after import, so it also pays for the
+libraries its stages load, and "analysis warm" sends it after the warm-up.
+Times are medians over --repeat runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_suite import get_ok, peak_rss_mb, put_dataset, use_memory_mongo
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("main", "analysis cold", "analysis warm")
+URL = "/get-analysis?blob_id={}&sections=sentiment,tfidf,topics,network"
+
+
+def run_scenario(scenario, rows):
+    """Runs one scenario in this process and prints its timings as JSON."""
+    service = scenario.split()[0]
+    use_memory_mongo(service)
+    result = {}
+    start = time.perf_counter()
+    if service == "main":
+        import main
+    else:
+        import analysis
+    result["import"] = time.perf_counter() - start
+
+    if service == "analysis":
+        if scenario == "analysis warm":
+            start = time.perf_counter()
+            analysis.readiness.run()
+            result["warm_up"] = time.perf_counter() - start
+        blob_id = put_dataset(analysis, "youtube", rows)
+        client = analysis.app.test_client()
+        start = time.perf_counter()
+        get_ok(client, URL.format(blob_id))
+        result["first_request"] = time.perf_counter() - start
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def measure(scenario, rows):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-scenario", scenario, "--rows", str(rows)],
+        capture_output=True, text=True, cwd=HERE, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        run_scenario(args.run_scenario, args.rows)
+        return
+
+    print(f"{'scenario':<14} {'import s':>9} {'warm-up s':>10} {'first request s':>16} {'peak MB':>8}")
+    for scenario in SCENARIOS:
+        runs = [measure(scenario, args.rows) for _ in range(args.repeat)]
+
+        def median(field):
+            values = [r[field] for r in runs if field in r]
+            return f"{statistics.median(values):.2f}" if values else "-"
+        print(f"{scenario:<14} {median('import'):>9} {median('warm_up'):>10} {median('first_request'):>16} "
+              f"{median('peak_rss_mb'):>8}")
+
+
+if __name__ == "__main__":
+    main()
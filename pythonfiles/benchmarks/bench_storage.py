@@ -0,0 +1,88 @@
+"""Stored size and text-column load time for each scrape storage format.
+
+    python bench_storage.py --rows 100000 1000000
+
+Rows are YouTube-shaped and go through the scrapers' DatasetWriter; loading
+uses the analysis service's reader, which pulls only the text column.
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "main"))
+sys.path.insert(0, os.path.join(HERE, "..", "analysis"))
+
+from corpus import synthetic_comments
+from gridfs_writer import FORMATS, DatasetWriter
+from ingest import open_text_chunks
+from youtube_fetch import COLUMN_TYPES, COMMENT_COLUMNS, TEXT_COLUMN
+
+PAGE_ROWS = 100
+
+
+class MemoryUpload(BytesIO):
+    """In-memory stand-in for a GridFS upload stream and the file it becomes."""
+
+    _id = None
+    upload_date = None
+
+    def __init__(self, metadata):
+        super().__init__()
+        self.metadata = metadata
+
+    def close(self):
+        # Keep the bytes readable after the writer closes the upload
+        self.length = len(self.getvalue())
+        self.seek(0)
+
+    def abort(self):
+        pass
+
+
+class MemoryBucket:
+    def open_upload_stream(self, filename, metadata=None):
+        self.upload = MemoryUpload(metadata)
+        return self.upload
+
+
+def youtube_rows(n):
+    page = []
+    for i, text in enumerate(synthetic_comments(n)):
+        page.append([f"vid{i % 50}", f"user{i}", text, "2024-01-01T00:00:00Z", i % 7, i % 3, f"c{i}"])
+        if len(page) == PAGE_ROWS:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'format':>8} {'MB':>8} {'write s':>8} {'load s':>8}")
+    for n in args.rows:
+        for file_format in FORMATS:
+            bucket = MemoryBucket()
+            start = time.perf_counter()
+            with DatasetWriter(bucket, "bench", COMMENT_COLUMNS, file_format,
+                               types=COLUMN_TYPES, text_column=TEXT_COLUMN) as out:
+                for page in youtube_rows(n):
+                    out.write_rows(page)
+            write_s = time.perf_counter() - start
+
+            blob = bucket.upload
+            start = time.perf_counter()
+            _, chunks = open_text_chunks(blob)
+            loaded = sum(len(chunk) for chunk in chunks)
+            load_s = time.perf_counter() - start
+            assert loaded == n
+            print(f"{n:>10} {file_format:>8} {blob.length / 1024 / 1024:>8.1f} {write_s:>8.2f} {load_s:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
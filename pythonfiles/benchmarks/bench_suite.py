@@ -0,0 +1,388 @@
+"""Wall time, peak RSS and throughput of each analysis stage and route.
+
+    python bench_suite.py --rows 1000 10000 100000
+    python bench_suite.py --rows 1000000 --cases analysis.sentiment main.scrape_youtube
+    python bench_suite.py --compare results/20240101-120000.json
+
+Datasets are synthetic YouTube- and Reddit-shaped scrapes (corpus.py)
+stored in mongomock's GridFS. Routes are driven through Flask's test
+client, and the scrape routes call fake API clients (fakes.py) with rate
+limits off. Each case runs in a fresh interpreter, so its peak RSS is its
+own and the two services' modules never share a process. setup_rss_mb is
+the peak before the timed part starts. Results are written as JSON under
+results/. With --compare, an earlier run's timings are printed alongside.
+
+Needs mongomock on top of the services' requirements.
+"""
+import argparse
+import json
+import os
+import platform as platform_info
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLATFORMS = ("youtube", "reddit")
+CASES = {}
+
+
+def case(service, platforms=PLATFORMS):
+    """Registers a case: fn(rows, platform) does the untimed setup and returns
+    the function to time."""
+    def register(fn):
+        CASES[f"{service}.{fn.__name__}"] = (service, platforms, fn)
+        return fn
+    return register
+
+
+# ========== SERVICE SETUP ==========
+
+def use_memory_mongo(service):
+    """Puts a service's modules on the path, with MongoDB replaced by an in-memory one."""
+    sys.path.insert(0, os.path.join(HERE, "..", service))
+    import mongomock
+    import mongomock.gridfs
+    import pymongo
+
+    mongomock.gridfs.enable_gridfs_integration()
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+    os.environ.setdefault("MONGODB_URI", "mongodb://benchmark")
+
+
+def load_service(service):
+    """Imports a service's app module against an in-memory MongoDB.
+
+    The analysis service is warmed up, as gunicorn does before forking its
+    workers, so cases time their stage rather than the imports it triggers.
+    """
+    use_memory_mongo(service)
+    if service == "main":
+        import main as app_module
+        app_module.youtube_fetch.youtube_rate_limit.rate = 0
+        app_module.reddit_crawl.reddit_rate_limit.rate = 0
+    else:
+        import analysis as app_module
+        app_module.readiness.run()
+    return app_module
+
+
+def put_dataset(app_module, platform, rows, seed=42, **metadata):
+    from corpus import PLATFORM_COLUMNS, dataset_csv
+
+    text_column = "comment" if platform == "youtube" else "Comment"
+    return app_module.fs.put(dataset_csv(platform, rows, seed), filename=f"{platform}_{rows}.csv", metadata={
+        "format": "csv", "columns": PLATFORM_COLUMNS[platform], "text_column": text_column, **metadata})
+
+
+def load_texts(app_module, blob_id):
+    from ingest import open_text_chunks
+
+    _, chunks = open_text_chunks(app_module.fs.get(blob_id))
+    return [text for chunk in chunks for text in chunk]
+
+
+def get_ok(client, url):
+    response = client.get(url)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{url}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+# ========== ANALYSIS STAGES ==========
+
+@case("analysis")
+def ingest(rows, platform):
+    app_module = load_service("analysis")
+    from ingest import open_text_chunks
+
+    blob_id = put_dataset(app_module, platform, rows)
+
+    def run():
+        _, chunks = open_text_chunks(app_module.fs.get(blob_id))
+        return sum(len(chunk) for chunk in chunks)
+    return run
+
+
+@case("analysis")
+def sentiment(rows, platform):
+    app_module = load_service("analysis")
+    from sentiment import score_texts
+
+    texts = load_texts(app_module, put_dataset(app_module, platform, rows))
+    return lambda: score_texts(texts)
+
+
+@case("analysis")
+def preprocess(rows, platform):
+    app_module = load_service("analysis")
+    from preprocess import preprocess as build_corpus
+
+    texts = load_texts(app_module, put_dataset(app_module, platform, rows))
+    return lambda: build_corpus(texts)
+
+
+def _corpus(rows, platform):
+    app_module = load_service("analysis")
+    from preprocess import preprocess as build_corpus
+
+    return build_corpus(load_texts(app_module, put_dataset(app_module, platform, rows)))
+
+
+@case("analysis")
+def tfidf(rows, platform):
+    corpus = _corpus(rows, platform)
+    from topics import count_matrix, top_tfidf
+
+    return lambda: top_tfidf(*count_matrix(corpus))
+
+
+@case("analysis")
+def topics(rows, platform):
+    corpus = _corpus(rows, platform)
+    from topics import count_matrix, fit_topics
+
+    return lambda: fit_topics(*count_matrix(corpus))
+
+
+@case("analysis")
+def network(rows, platform):
+    corpus = _corpus(rows, platform)
+    from cooccurrence import cooccurrence_matrix
+    from graph import CooccurrenceGraph
+
+    def run():
+        graph = CooccurrenceGraph(*cooccurrence_matrix(corpus))
+        return graph.edges(), graph.layout()
+    return run
+
+
+@case("analysis")
+def wordcloud(rows, platform):
+    corpus = _corpus(rows, platform)
+    from render import render_wordcloud
+
+    frequencies = dict(zip(corpus.vocab, corpus.frequencies().tolist()))
+    return lambda: render_wordcloud(frequencies)
+
+
+@case("analysis")
+def graph_image(rows, platform):
+    corpus = _corpus(rows, platform)
+    from cooccurrence import cooccurrence_matrix
+    from graph import CooccurrenceGraph
+    from render import render_graph
+
+    graph = CooccurrenceGraph(*cooccurrence_matrix(corpus))
+    positions = graph.layout()
+    return lambda: render_graph(graph.to_networkx(), positions)
+
+
+# ========== ANALYSIS ROUTES ==========
+
+@case("analysis")
+def route_full(rows, platform):
+    app_module = load_service("analysis")
+    blob_id = put_dataset(app_module, platform, rows)
+    client = app_module.app.test_client()
+    # The legacy payload: every section, images inline, one score per comment
+    return lambda: get_ok(client, f"/get-analysis?blob_id={blob_id}")
+
+
+@case("analysis")
+def route_sections(rows, platform):
+    app_module = load_service("analysis")
+    blob_id = put_dataset(app_module, platform, rows)
+    client = app_module.app.test_client()
+    return lambda: get_ok(client, f"/get-analysis?blob_id={blob_id}&sections=sentiment,tfidf,topics,network")
+
+
+@case("analysis")
+def route_sections_cached(rows, platform):
+    app_module = load_service("analysis")
+    blob_id = put_dataset(app_module, platform, rows)
+    client = app_module.app.test_client()
+    url = f"/get-analysis?blob_id={blob_id}&sections=sentiment,tfidf,topics,network"
+    get_ok(client, url)
+    return lambda: get_ok(client, url)
+
+
+@case("analysis")
+def route_aggregate(rows, platform):
+    # rows spread over ten files scraped on consecutive days
+    app_module = load_service("analysis")
+    blob_ids = []
+    for day in range(10):
+        blob_id = put_dataset(app_module, platform, max(1, rows // 10), seed=day)
+        app_module.db["fs.files"].update_one({"_id": blob_id}, {"$set": {"uploadDate": datetime(2024, 1, 1 + day)}})
+        blob_ids.append(str(blob_id))
+    client = app_module.app.test_client()
+    return lambda: get_ok(client, "/aggregate-analysis?blob_ids=" + ",".join(blob_ids))
+
+
+# ========== SCRAPER ROUTES ==========
+
+@case("main", platforms=("youtube",))
+def scrape_youtube(rows, platform):
+    app_module = load_service("main")
+    from corpus import YOUTUBE_COLUMNS
+    from fakes import FakeYouTube
+
+    assert app_module.youtube_fetch.COMMENT_COLUMNS == YOUTUBE_COLUMNS
+    videos = 10
+    api = FakeYouTube(videos=videos, per_video=max(1, rows // videos))
+    app_module.youtube_clients.build = lambda key: api
+    client = app_module.app.test_client()
+    return lambda: get_ok(client, f"/scrape-comments?email=bench@example.com&query=bench"
+                                  f"&search_limit={videos}&comment_limit={api.per_video}")
+
+
+@case("main", platforms=("reddit",))
+def scrape_reddit(rows, platform):
+    app_module = load_service("main")
+    from corpus import REDDIT_COLUMNS
+    from fakes import FakeReddit
+
+    assert app_module.reddit_crawl.COMMENT_COLUMNS == REDDIT_COLUMNS
+    subs, posts = 5, 10
+    api = FakeReddit(per_post=max(1, rows // (subs * posts)))
+    app_module.reddit_clients.build = lambda *credentials: api
+    client = app_module.app.test_client()
+    return lambda: get_ok(client, f"/scrape-reddit?email=bench@example.com&query=bench&sub_limit={subs}"
+                                  f"&post_limit={posts}&comment_limit={api.per_post}")
+
+
+@case("main")
+def keyword_count(rows, platform):
+    app_module = load_service("main")
+    import history_stats
+
+    blob = app_module.fs.get(put_dataset(app_module, platform, rows))
+    return lambda: history_stats.count_blob(app_module.fs, blob, history_stats.DEFAULT_KEYWORDS)
+
+
+@case("main")
+def user_history(rows, platform):
+    # One entry from before stats were stored, so the route counts its file
+    app_module = load_service("main")
+    blob_id = put_dataset(app_module, platform, rows)
+    app_module.user_history_col.insert_one({"email": "bench@example.com", "platform": platform,
+                                            "query": "bench", "csv_blob_id": blob_id})
+    client = app_module.app.test_client()
+    return lambda: get_ok(client, "/user-history?email=bench@example.com")
+
+
+@case("main")
+def download_csv(rows, platform):
+    app_module = load_service("main")
+    blob_id = put_dataset(app_module, platform, rows)
+    client = app_module.app.test_client()
+    return lambda: len(get_ok(client, f"/download-csv/{blob_id}").get_data())
+
+
+# ========== RUNNER ==========
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name, platform, rows):
+    """Runs one case in this process and prints its measurement as JSON."""
+    _, _, fn = CASES[name]
+    timed = fn(rows, platform)
+    setup_rss = peak_rss_mb()
+    start = time.perf_counter()
+    timed()
+    seconds = time.perf_counter() - start
+    print(json.dumps({"seconds": seconds, "setup_rss_mb": setup_rss, "peak_rss_mb": peak_rss_mb()}))
+
+
+def measure(name, platform, rows, timeout):
+    result = {"case": name, "platform": platform, "rows": rows}
+    try:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-case", name,
+             "--platforms", platform, "--rows", str(rows)],
+            capture_output=True, text=True, timeout=timeout, cwd=HERE,
+        )
+    except subprocess.TimeoutExpired:
+        return {**result, "error": f"timed out after {timeout}s"}
+    lines = out.stdout.strip().splitlines()
+    if out.returncode or not lines:
+        return {**result, "error": (out.stderr.strip().splitlines() or ["failed"])[-1]}
+    measured = json.loads(lines[-1])
+    return {**result, **measured, "rows_per_second": rows / measured["seconds"] if measured["seconds"] else None}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=HERE).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_row(result, previous=None):
+    if "error" in result:
+        print(f"{result['case']:<32} {result['platform']:>8} {result['rows']:>9}  error: {result['error']}")
+        return
+    line = (f"{result['case']:<32} {result['platform']:>8} {result['rows']:>9} {result['seconds']:>9.3f} "
+            f"{result['rows_per_second']:>12.0f} {result['peak_rss_mb']:>8.0f} {result['setup_rss_mb']:>8.0f}")
+    if previous and "seconds" in previous:
+        line += f" {previous['seconds']:>9.3f} {previous['seconds'] / result['seconds']:>7.2f}x"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="dataset sizes; 1000000 is supported but slow for the full analysis routes")
+    parser.add_argument("--platforms", nargs="+", choices=PLATFORMS, default=list(PLATFORMS))
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES),
+                        metavar="CASE", help=f"any of: {', '.join(sorted(CASES))}")
+    parser.add_argument("--timeout", type=int, default=1800, help="seconds allowed per measurement")
+    parser.add_argument("--out", help="results file (default results/<time>.json)")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(args.run_case, args.platforms[0], args.rows[0])
+        return
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {(r["case"], r["platform"], r["rows"]): r for r in json.load(f)["results"]}
+
+    started = datetime.now(timezone.utc)
+    print(f"{'case':<32} {'platform':>8} {'rows':>9} {'seconds':>9} {'rows/s':>12} {'peak MB':>8} "
+          f"{'setup MB':>8}" + (f" {'before s':>9} {'speedup':>8}" if previous else ""))
+    results = []
+    for name in args.cases:
+        _, platforms, _ = CASES[name]
+        for platform in [p for p in args.platforms if p in platforms]:
+            for rows in args.rows:
+                result = measure(name, platform, rows, args.timeout)
+                results.append(result)
+                print_row(result, previous.get((name, platform, rows)))
+
+    out = args.out or os.path.join(HERE, "results", started.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({
+            "started": started.isoformat(),
+            "commit": git_commit(),
+            "python": platform_info.python_version(),
+            "machine": platform_info.machine(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, f, indent=2)
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
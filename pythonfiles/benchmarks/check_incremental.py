@@ -0,0 +1,156 @@
+"""Checks incremental scraping: high-water marks, resume points and segment chains.
+
+    python check_incremental.py
+
+Drives the scraper's routes with the fake API clients (fakes.py) against
+mongomock, as bench_suite does, adding comments between runs. Exits
+non-zero at the first failed check.
+
+Needs mongomock on top of the scraper service's requirements.
+"""
+import csv
+import io
+
+from bench_suite import get_ok, load_service
+from fakes import FakeReddit, FakeYouTube
+
+app_module = load_service("main")
+client = app_module.app.test_client()
+
+import incremental
+from segments import segment_chain
+
+
+class RecordingYouTube(FakeYouTube):
+    """Remembers the order each comment listing asked for."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.orders = set()
+
+    def list(self, **kwargs):
+        if "videoId" in kwargs:
+            self.orders.add(kwargs.get("order"))
+        return super().list(**kwargs)
+
+
+# Each check's user gets its own fake, through their own API key, since the
+# service pools clients by key
+apis = {}
+app_module.youtube_clients.build = lambda key: apis[key]
+app_module.reddit_clients.build = lambda client_id, *credentials: apis[client_id]
+
+
+def use_api(email, api):
+    app_module.user_keys_col.insert_one({"email": email, "youtube_api": email, "reddit_client_id": email})
+    apis[email] = api
+    return api
+
+
+def scrape(path, email, **params):
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    return get_ok(client, f"{path}?email={email}&{query}").get_json()
+
+
+def dataset_ids(blob_id):
+    rows = list(csv.reader(io.StringIO(get_ok(client, f"/download-csv/{blob_id}").get_data(as_text=True))))
+    column = rows[0].index("comment_id")
+    return [row[column] for row in rows[1:]]
+
+
+def check_capped_walk_resumes_instead_of_skipping():
+    # 250 comments fetched 100 per run, with 5 posted after the first run
+    api = use_api("capped@x", RecordingYouTube(videos=1, per_video=250))
+    new_rows = []
+    for run in range(5):
+        response = scrape("/scrape-comments", "capped@x", video_ids="vid0000", comment_limit=100, incremental=1)
+        new_rows.append(response["new_rows"])
+        if run == 0:
+            state = app_module.scrape_state.open("capped@x", "youtube", "|vid0000")
+            mark = state["marks"]["vid0000"]
+            assert mark["hwm"] is None and mark["resume"]["page_token"] == "100", mark
+            api.per_video = 255
+    assert new_rows == [100, 100, 50, 5, 0], new_rows
+    assert api.orders == {"time"}, api.orders
+
+    ids = dataset_ids(response["blob_id"])
+    assert len(ids) == len(set(ids)) == 255, len(ids)
+    mark = app_module.scrape_state.open("capped@x", "youtube", "|vid0000")["marks"]["vid0000"]
+    assert mark["resume"] is None and mark["hwm"] is not None, mark
+
+
+def check_segment_chain_links_every_run():
+    api = use_api("chain@x", FakeYouTube(videos=2, per_video=30))
+    blob_ids = []
+    for per_video in (30, 40, 40, 45):
+        api.per_video = per_video
+        blob_ids.append(scrape("/scrape-comments", "chain@x", video_ids="vid0000,vid0001",
+                               comment_limit=100, incremental=1)["blob_id"])
+    # The run that found nothing new wrote no segment
+    assert blob_ids[2] == blob_ids[1], blob_ids
+    head = app_module.fs.get(app_module.ObjectId(blob_ids[-1]))
+    chain = segment_chain(app_module.fs, head)
+    assert [str(s._id) for s in chain] == [blob_ids[0], blob_ids[1], blob_ids[3]], chain
+    assert (chain[0].metadata or {}).get("previous_blob_id") is None
+    for previous, segment in zip(chain, chain[1:]):
+        assert segment.metadata["previous_blob_id"] == previous._id
+
+    entries = list(app_module.user_history_col.find({"email": "chain@x"}))
+    assert len(entries) == 1, entries
+    assert str(entries[0]["csv_blob_id"]) == blob_ids[-1]
+    assert entries[0]["row_count"] == 90 and entries[0]["segments"] == 3, entries[0]
+    assert len(set(dataset_ids(blob_ids[-1]))) == 90
+
+
+def check_lost_race_leaves_marks_alone():
+    state = app_module.scrape_state.open("race@x", "youtube", "q")
+    rival = app_module.scrape_state.open("race@x", "youtube", "q")
+    columns = ["video_id", "comment_id", "published_at"]
+    won = incremental.RunMarks(columns, "video_id", "comment_id", "published_at")
+    won.update([["v", "a", "2024-01-01T00:00:00Z"]])
+    lost = incremental.RunMarks(columns, "video_id", "comment_id", "published_at")
+    lost.update([["v", "b", "2024-02-01T00:00:00Z"]])
+
+    assert app_module.scrape_state.advance(rival, "head-1", won)
+    assert not app_module.scrape_state.advance(state, "head-2", lost)
+    stored = app_module.scrape_state.open("race@x", "youtube", "q")
+    assert stored["head_blob_id"] == "head-1", stored
+    assert stored["marks"]["v"]["seen"] == ["a"] and stored["marks"]["v"]["hwm"] == "2024-01-01T00:00:00Z"
+
+
+def check_plain_scrape_keeps_relevance_order():
+    api = use_api("plain@x", RecordingYouTube(videos=1, per_video=10))
+    scrape("/scrape-comments", "plain@x", video_ids="vid0000", comment_limit=100)
+    assert api.orders == {None}, api.orders
+
+
+def check_capped_reddit_post_is_fetched_again():
+    # 30 comments per post, 20 per post per run
+    api = use_api("reddit@x", FakeReddit(per_post=30))
+    params = dict(query="q", sub_limit=1, post_limit=2, comment_limit=20, incremental=1)
+    new_rows = [scrape("/scrape-reddit", "reddit@x", **params)["new_rows"] for _ in range(3)]
+    assert new_rows == [40, 20, 0], new_rows
+    api.per_post = 35
+    response = scrape("/scrape-reddit", "reddit@x", **params)
+    assert response["new_rows"] == 10, response
+    ids = dataset_ids(response["blob_id"])
+    assert len(ids) == len(set(ids)) == 70, len(ids)
+
+
+CHECKS = [
+    check_capped_walk_resumes_instead_of_skipping,
+    check_segment_chain_links_every_run,
+    check_lost_race_leaves_marks_alone,
+    check_plain_scrape_keeps_relevance_order,
+    check_capped_reddit_post_is_fetched_again,
+]
+
+
+def main():
+    for check in CHECKS:
+        check()
+        print(f"ok  {check.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Checks that API quota uses are taken atomically under concurrent requests.
+
+    python check_quota.py
+
+Many threads call consume_quota at once against mongomock. MongoDB applies
+each single-document update atomically; mongomock does not across threads,
+so its find_one_and_update is serialized here to match. Exits non-zero at
+the first failed check.
+
+Needs mongomock on top of the scraper service's requirements.
+"""
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+import mongomock
+
+from clients import UNLIMITED_USES, QuotaExceeded, consume_quota
+
+CALLERS = 32
+FIELD = "youtube_use_count"
+
+
+def keys_collection(**fields):
+    """A user_keys collection holding one user, a@x, with the given fields."""
+    col = mongomock.MongoClient().db.user_keys
+    lock = threading.Lock()
+    find_one_and_update = col.find_one_and_update
+
+    def atomic_find_one_and_update(*args, **kwargs):
+        with lock:
+            return find_one_and_update(*args, **kwargs)
+    col.find_one_and_update = atomic_find_one_and_update
+    if fields:
+        col.insert_one({"email": "a@x", **fields})
+    return col
+
+
+def take_concurrently(col, callers=CALLERS):
+    """The uses remaining as seen by each caller that got one, and the number refused."""
+    barrier = threading.Barrier(callers)
+
+    def take():
+        barrier.wait()
+        try:
+            return consume_quota(col, "a@x", FIELD)[0]
+        except QuotaExceeded:
+            return None
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        results = list(pool.map(lambda _: take(), range(callers)))
+    taken = [r for r in results if r is not None]
+    return taken, results.count(None)
+
+
+def check_counted_quota_stops_at_zero():
+    col = keys_collection(**{FIELD: 5})
+    taken, refused = take_concurrently(col)
+    assert sorted(taken) == [0, 1, 2, 3, 4], taken
+    assert refused == CALLERS - 5, refused
+    assert col.find_one({"email": "a@x"})[FIELD] == 0
+
+
+def check_string_count_converted_once():
+    # Counts written as strings by older code
+    col = keys_collection(**{FIELD: "5"})
+    taken, refused = take_concurrently(col)
+    assert sorted(taken) == [0, 1, 2, 3, 4], taken
+    assert refused == CALLERS - 5, refused
+    assert col.find_one({"email": "a@x"})[FIELD] == 0
+
+
+def check_unlimited_is_not_counted():
+    col = keys_collection(**{FIELD: "unlimited"})
+    taken, refused = take_concurrently(col)
+    assert taken == [UNLIMITED_USES] * CALLERS and refused == 0, (taken, refused)
+    assert col.find_one({"email": "a@x"})[FIELD] == "unlimited"
+
+
+def check_no_document_is_unlimited():
+    taken, refused = take_concurrently(keys_collection())
+    assert taken == [UNLIMITED_USES] * CALLERS and refused == 0, (taken, refused)
+
+
+def check_exhausted_quota_refuses():
+    col = keys_collection(**{FIELD: 0})
+    taken, refused = take_concurrently(col)
+    assert not taken and refused == CALLERS, (taken, refused)
+    assert col.find_one({"email": "a@x"})[FIELD] == 0
+
+
+CHECKS = [
+    check_counted_quota_stops_at_zero,
+    check_string_count_converted_once,
+    check_unlimited_is_not_counted,
+    check_no_document_is_unlimited,
+    check_exhausted_quota_refuses,
+]
+
+
+def main():
+    for check in CHECKS:
+        check()
+        print(f"ok  {check.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Checks that the modules both services carry a copy of are still identical.
+
+    python check_shared_modules.py
+
+analysis/ and main/ each deploy from their own directory, so a module both
+use is kept as a copy in each. Exits non-zero at the first pair that
+differs, naming the first differing line.
+"""
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVICES = ("analysis", "main")
+SHARED_MODULES = ("metrics.py", "segments.py")
+
+
+def read_lines(service, name):
+    with open(os.path.join(ROOT, service, name), encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def check_identical(name):
+    first, second = (read_lines(service, name) for service in SERVICES)
+    for number, (a, b) in enumerate(zip(first, second), 1):
+        assert a == b, f"{name} differs at line {number}:\n  {SERVICES[0]}: {a}\n  {SERVICES[1]}: {b}"
+    assert len(first) == len(second), f"{name}: {len(first)} lines in {SERVICES[0]}, {len(second)} in {SERVICES[1]}"
+
+
+def main():
+    for name in SHARED_MODULES:
+        check_identical(name)
+        print(f"ok  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import csv
+import io
+import random
+import time
+
+# Small fixed vocabulary with a Zipf-like frequency profile, mixed with
+# punctuation and numbers so tokenizers see realistic noise
+WORDS = (
+    "the a and to of is in it this that i you for on was with are be so but not "
+    "video great love like good bad really just one have what game music song "
+    "best worst ever watch people time make know think new first thanks funny "
+    "awesome terrible amazing boring review channel content quality price phone "
+    "battery camera screen update bug feature app data social sentiment brand "
+    "product service support team season episode movie trailer launch release"
+).split()
+NOISE = ["!", "?", "lol", "100%", "2024", ":)", "...", "https://t.co/x"]
+
+
+def synthetic_comments(n, seed=42, min_words=4, max_words=60):
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(WORDS))]
+    for _ in range(n):
+        length = rng.randint(min_words, max_words)
+        words = rng.choices(WORDS, weights=weights, k=length)
+        if rng.random() < 0.3:
+            words.append(rng.choice(NOISE))
+        yield " ".join(words).capitalize()
+
+
+# Columns as the scrapers write them (youtube_fetch / reddit_crawl.COMMENT_COLUMNS)
+YOUTUBE_COLUMNS = ["video_id", "author_name", "comment", "published_at", "likes", "reply_count",
+                   "comment_id"]
+REDDIT_COLUMNS = ["Post URL", "Comment", "subreddit", "post_id", "post_score",
+                  "comment_id", "parent_id", "author", "score", "created_utc"]
+PLATFORM_COLUMNS = {"youtube": YOUTUBE_COLUMNS, "reddit": REDDIT_COLUMNS}
+
+START_UTC = 1704067200  # 2024-01-01
+
+
+def youtube_rows(n, seed=42, videos=50):
+    rng = random.Random(seed)
+    for i, text in enumerate(synthetic_comments(n, seed=seed)):
+        published = START_UTC + i * 37
+        yield [f"vid{i % videos:04d}", f"user{rng.randrange(n // 3 + 1)}", text,
+               time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(published)),
+               int(rng.paretovariate(1.2)) - 1, rng.randrange(4), f"Ugx{i:012d}"]
+
+
+def reddit_rows(n, seed=42, posts=250, subreddits=5):
+    rng = random.Random(seed)
+    for i, text in enumerate(synthetic_comments(n, seed=seed)):
+        post = i % posts
+        parent = f"t3_p{post:05d}" if rng.random() < 0.6 else f"t1_c{rng.randrange(i + 1):08d}"
+        yield [f"https://www.reddit.com/r/sub{post % subreddits}/comments/p{post:05d}/", text,
+               f"sub{post % subreddits}", f"p{post:05d}", 10 + post % 90, f"c{i:08d}", parent,
+               f"user{rng.randrange(n // 3 + 1)}", int(rng.paretovariate(1.2)) - 1,
+               float(START_UTC + i * 37)]
+
+
+PLATFORM_ROWS = {"youtube": youtube_rows, "reddit": reddit_rows}
+
+
+def write_dataset(f, platform, n, seed=42):
+    """Writes n rows shaped like a platform's scrape to text file f as CSV."""
+    writer = csv.writer(f)
+    writer.writerow(PLATFORM_COLUMNS[platform])
+    writer.writerows(PLATFORM_ROWS[platform](n, seed=seed))
+
+
+def dataset_csv(platform, n, seed=42):
+    buf = io.StringIO()
+    write_dataset(buf, platform, n, seed)
+    return buf.getvalue().encode()
@@ -0,0 +1,152 @@
+"""Stand-ins for the YouTube Data API and praw clients the scrapers call.
+
+Responses have the shape the real ones do, filled from the synthetic corpus,
+and come back immediately, so a scrape benchmark measures this code rather
+than the network.
+"""
+import time
+
+from corpus import START_UTC, synthetic_comments
+
+# Comment texts are drawn round-robin from a fixed pool so a fake serving a
+# million comments does not hold a million strings
+TEXT_POOL = list(synthetic_comments(10000, seed=7))
+
+
+def _text(k):
+    return TEXT_POOL[k % len(TEXT_POOL)]
+
+
+class _Request:
+    def __init__(self, build):
+        self._build = build
+
+    def execute(self, http=None, **kwargs):
+        return self._build()
+
+
+class FakeYouTube:
+    """videos videos with per_video comments each, listed newest first.
+
+    Raising per_video adds newer comments; the existing ones keep their ids
+    and times, and page tokens are offsets from the newest, as if comments
+    had been posted since the last scrape.
+    """
+
+    def __init__(self, videos=10, per_video=100):
+        self.videos = [f"vid{v:04d}" for v in range(videos)]
+        self.per_video = per_video
+        self.calls = 0
+
+    def search(self):
+        return self
+
+    def commentThreads(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls += 1
+        if "q" in kwargs:
+            items = [{"id": {"videoId": v}} for v in self.videos[:kwargs.get("maxResults", 5)]]
+            return _Request(lambda: {"items": items})
+        return _Request(lambda: self._threads(kwargs["videoId"], int(kwargs.get("pageToken") or 0),
+                                              kwargs["maxResults"]))
+
+    def _threads(self, video_id, start, size):
+        v = self.videos.index(video_id)
+        items = []
+        for k in range(start, min(start + size, self.per_video)):
+            newest = self.per_video - 1 - k
+            published = START_UTC + newest * 37
+            items.append({"id": f"Ugx{v:04d}{newest:08d}", "snippet": {
+                "totalReplyCount": newest % 4,
+                "topLevelComment": {"snippet": {
+                    "authorDisplayName": f"user{newest % 997}",
+                    "textDisplay": _text(v * self.per_video + newest),
+                    "publishedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(published)),
+                    "likeCount": newest % 7,
+                }},
+            }})
+        page = {"items": items}
+        if start + size < self.per_video:
+            page["nextPageToken"] = str(start + size)
+        return page
+
+
+class _Author:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Comment:
+    def __init__(self, post_id, k, text):
+        self.id = f"{post_id}c{k}"
+        self.body = text
+        self.parent_id = f"t3_{post_id}"
+        self.author = _Author(f"user{k % 997}") if k % 13 else None
+        self.score = k % 50
+        self.created_utc = float(START_UTC + k * 37)
+
+
+class _Comments:
+    def __init__(self, post):
+        self._post = post
+
+    def replace_more(self, limit=None):
+        return []
+
+    def list(self):
+        post = self._post
+        return [_Comment(post.id, k, _text(post.number * post.reddit.per_post + k))
+                for k in range(post.reddit.per_post)]
+
+
+class _Submission:
+    def __init__(self, reddit, number, subreddit):
+        self.reddit = reddit
+        self.number = number
+        self.id = f"p{number:05d}"
+        self.url = f"https://www.reddit.com/r/{subreddit.display_name}/comments/{self.id}/"
+        self.subreddit = subreddit
+        self.score = 10 + number % 90
+        self.num_comments = reddit.per_post
+
+    @property
+    def comments(self):
+        self.reddit.calls += 1
+        return _Comments(self)
+
+
+class _Subreddit:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.display_name = name
+
+    def search(self, query, limit=None):
+        self.reddit.calls += 1
+        base = int(self.display_name[3:]) * limit
+        return [_Submission(self.reddit, base + i, self) for i in range(limit)]
+
+
+class _Subreddits:
+    def __init__(self, reddit):
+        self._reddit = reddit
+
+    def search(self, query, limit=None):
+        return [_Subreddit(self._reddit, f"sub{i}") for i in range(limit)]
+
+
+class FakeReddit:
+    """Subreddits sub0, sub1, ... whose posts each have per_post comments."""
+
+    def __init__(self, per_post=20):
+        self.per_post = per_post
+        self.calls = 0
+        self.subreddits = _Subreddits(self)
+
+    def subreddit(self, name):
+        return _Subreddit(self, name)
+
+    def submission(self, id):
+        number = int(id[1:])
+        return _Submission(self, number, _Subreddit(self, "sub0"))
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import ReturnDocument
+
+API_CLIENT_TTL_SECONDS = int(os.getenv("API_CLIENT_TTL", 3600))
+API_CLIENT_POOL_SIZE = int(os.getenv("API_CLIENT_POOL_SIZE", 64))
+
+# What an "unlimited" quota is reported as, as before
+UNLIMITED_USES = 100000
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class ClientPool:
+    """API clients keyed by a hash of their credentials.
+
+    Building a client (the YouTube discovery document in particular) is
+    far slower than the requests it then makes, so clients are reused
+    until ttl seconds after they were built. Keys are hashed so raw
+    secrets are not kept as dict keys.
+    """
+
+    def __init__(self, build, ttl=API_CLIENT_TTL_SECONDS, max_entries=API_CLIENT_POOL_SIZE):
+        self.build = build
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, *credentials):
+        key = hashlib.sha256("\0".join(str(c) for c in credentials).encode()).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._clients.move_to_end(key)
+                return entry[0]
+
+        # Built outside the lock; two threads racing on a new key just build twice
+        client = self.build(*credentials)
+        with self._lock:
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_entries:
+                self._clients.popitem(last=False)
+        return client
+
+
+def consume_quota(user_keys_col, email, field, fields=None):
+    """Takes one use from email's field counter and returns (remaining, keys).
+
+    keys holds the requested fields of the user's document, so credentials
+    come back in the same round trip. A counted quota is decremented in a
+    single find_one_and_update guarded by $gt: 0, so concurrent requests can
+    never take it below zero. "unlimited" (or no document, as before) is not
+    counted. Raises QuotaExceeded when no uses are left.
+    """
+    projection = {f: 1 for f in (fields or ())}
+    projection[field] = 1
+    keys = user_keys_col.find_one_and_update(
+        {"email": email, field: {"$gt": 0}},
+        {"$inc": {field: -1}},
+        projection=projection,
+        return_document=ReturnDocument.AFTER,
+    )
+    if keys is not None:
+        return keys[field], keys
+
+    keys = user_keys_col.find_one({"email": email}, projection) or {}
+    count = keys.get(field, "unlimited")
+    if str(count).lower() == "unlimited":
+        return UNLIMITED_USES, keys
+    # Counts written as strings by older code are converted on first use
+    if isinstance(count, str) and count.isdigit() and int(count) > 0:
+        updated = user_keys_col.find_one_and_update(
+            {"email": email, field: count},
+            {"$set": {field: int(count) - 1}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is not None:
+            return updated[field], updated
+        return consume_quota(user_keys_col, email, field, fields)
+    raise QuotaExceeded
@@ -0,0 +1,46 @@
+import os
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+from metrics import MongoCommandTimer
+
+DB_NAME = "SocialAnalysis"
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", 60000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+# GridFS streams large scrapes, so individual reads get more room
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 60000))
+
+# History fields the file listings show
+SCRAPED_FILE_FIELDS = {"email": 1, "platform": 1, "query": 1, "csv_blob_id": 1, "filename": 1,
+                       "upload_time": 1, "file_size": 1, "row_count": 1}
+
+
+def connect(uri):
+    # connect=False defers opening sockets until the first operation. This
+    # service creates its indexes at import, which is such an operation, so
+    # it must not be preloaded into a forking server's master.
+    client = MongoClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        connect=False,
+        # Every command's time goes to the mongo_<command> stage metrics
+        event_listeners=[MongoCommandTimer()],
+    )
+    return client, client[DB_NAME]
+
+
+def ensure_indexes(db):
+    # Listings filter on email and sort newest first; deletes and the
+    # analysis service look entries up by blob
+    db["user_history"].create_index([("email", ASCENDING), ("upload_time", DESCENDING)])
+    db["user_history"].create_index("csv_blob_id")
+    db["user_keys"].create_index("email")
@@ -0,0 +1,58 @@
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+def iter_pages(produce, items, workers):
+    """Run produce(item) for each item on a thread pool, yielding pages as they arrive.
+
+    produce is a generator function yielding pages (lists of rows). At most
+    `workers` finished pages wait in memory: producers block until the
+    consumer catches up. The first exception raised by a producer is
+    re-raised here, and stopping early releases the blocked producers.
+    """
+    if not items:
+        return
+    pages = queue.Queue(maxsize=workers)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(item):
+        try:
+            for page in produce(item):
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(items)))
+    for item in items:
+        # Producers run in the caller's context, so what they time counts
+        # towards the request that started them
+        pool.submit(contextvars.copy_context().run, run, item)
+    try:
+        finished = 0
+        while finished < len(items):
+            page = pages.get()
+            if page is _DONE:
+                finished += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
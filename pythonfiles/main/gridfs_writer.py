@@ -0,0 +1,204 @@
+import csv
+import gzip
+import io
+import os
+from itertools import islice
+
+from metrics import timed
+from segments import segment_chain
+
+# Formats a scrape can be stored in; the choice is recorded in the file's metadata
+FORMATS = ("csv", "csv.gz", "parquet")
+
+# Rows are encoded into this much CSV text before being handed to GridFS
+FLUSH_BYTES = int(os.getenv("SCRAPE_FLUSH_BYTES", 256 * 1024))
+# Parquet compresses and encodes per row group, so rows are buffered up to this
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("SCRAPE_PARQUET_ROW_GROUP", 10000))
+PARQUET_COMPRESSION = os.getenv("SCRAPE_PARQUET_COMPRESSION", "zstd")
+
+
+class DatasetWriter:
+    """Streams scraped rows into a GridFS upload as they are produced.
+
+    The file's metadata records format, columns, column types and the text
+    column, so readers can pick the right decoder and load only the text
+    without guessing. Use as a context manager: on error the partial upload
+    is aborted, so no truncated file is left behind; calling abort() inside
+    the block discards the file too. file_id, length and upload_date are set
+    once the upload is closed.
+    """
+
+    def __init__(self, bucket, filename, columns, format="csv", types=None, text_column=None,
+                 metadata=None):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        types = {c: (types or {}).get(c, str) for c in columns}
+        self.filename = filename
+        self.columns = columns
+        self.format = format
+        self.row_count = 0
+        self.file_id = None
+        self.length = None
+        self.upload_date = None
+        self._aborted = False
+        self._grid_in = bucket.open_upload_stream(filename, metadata={
+            "format": format,
+            "columns": columns,
+            "types": {c: t.__name__ for c, t in types.items()},
+            "text_column": text_column,
+            **(metadata or {}),
+        })
+        if format == "parquet":
+            self._encoder = _ParquetEncoder(self._grid_in, columns, types)
+        else:
+            self._encoder = _CsvEncoder(self._grid_in, columns, compress=format == "csv.gz")
+
+    def write_rows(self, rows):
+        with timed("gridfs_write"):
+            self._encoder.write_rows(rows)
+        self.row_count += len(rows)
+
+    def close(self):
+        with timed("gridfs_write"):
+            self._encoder.close()
+            self._grid_in.close()
+        self.file_id = self._grid_in._id
+        self.length = self._grid_in.length
+        self.upload_date = self._grid_in.upload_date
+        return self.file_id
+
+    def abort(self):
+        if not self._aborted:
+            self._aborted = True
+            self._grid_in.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        elif not self._aborted:
+            self.close()
+        return False
+
+
+class _CsvEncoder:
+    def __init__(self, grid_in, columns, compress=False):
+        self._gzip = gzip.GzipFile(fileobj=grid_in, mode="wb", compresslevel=6) if compress else None
+        self._out = self._gzip or grid_in
+        self._buf = io.StringIO()
+        # Same dialect pandas' to_csv used for these files
+        self._csv = csv.writer(self._buf, lineterminator="\n")
+        self._csv.writerow(columns)
+
+    def write_rows(self, rows):
+        self._csv.writerows(rows)
+        if self._buf.tell() >= FLUSH_BYTES:
+            self._flush()
+
+    def _flush(self):
+        data = self._buf.getvalue()
+        if data:
+            self._out.write(data.encode())
+            self._buf.seek(0)
+            self._buf.truncate()
+
+    def close(self):
+        self._flush()
+        if self._gzip is not None:
+            self._gzip.close()
+
+
+class _PositionTracker:
+    # pyarrow needs tell() on its sink, which GridIn does not provide
+    def __init__(self, raw):
+        self._raw = raw
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        self._raw.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class _ParquetEncoder:
+    def __init__(self, grid_in, columns, types):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        arrow_types = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+        self._pa = pa
+        self._schema = pa.schema([(c, arrow_types[types[c]]) for c in columns])
+        self._writer = pq.ParquetWriter(_PositionTracker(grid_in), self._schema,
+                                        compression=PARQUET_COMPRESSION)
+        self._rows = []
+
+    def write_rows(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= PARQUET_ROW_GROUP_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        arrays = [self._pa.array(list(col), type=field.type)
+                  for col, field in zip(zip(*self._rows), self._schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def iter_csv(blob, chunk_size=256 * 1024, header=True):
+    """Yields a stored dataset as CSV bytes, converting from its stored format."""
+    file_format = (blob.metadata or {}).get("format", "csv")
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(blob)
+        empty = True
+        for batch in parquet.iter_batches():
+            yield batch.to_pandas().to_csv(index=False, header=header).encode()
+            header = empty = False
+        if empty and header:
+            yield parquet.schema_arrow.empty_table().to_pandas().to_csv(index=False).encode()
+        return
+    source = gzip.GzipFile(fileobj=blob, mode="rb") if file_format == "csv.gz" else blob
+    if not header:
+        source.readline()
+    yield from iter(lambda: source.read(chunk_size), b"")
+
+
+def iter_dataset_csv(fs, blob):
+    """All of a dataset's segments as one CSV, with a single header."""
+    for i, segment in enumerate(segment_chain(fs, blob)):
+        yield from iter_csv(segment, header=i == 0)
+
+
+def iter_rows(blob, page_rows=10000):
+    """Yields a stored dataset's rows, without the header, in pages of lists."""
+    file_format = (blob.metadata or {}).get("format", "csv")
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(blob).iter_batches(batch_size=page_rows):
+            yield [list(row) for row in zip(*(col.to_pylist() for col in batch.columns))]
+        return
+    source = gzip.GzipFile(fileobj=blob, mode="rb") if file_format == "csv.gz" else blob
+    reader = csv.reader(io.TextIOWrapper(source, encoding="utf-8", newline=""))
+    next(reader, None)
+    while page := list(islice(reader, page_rows)):
+        yield page
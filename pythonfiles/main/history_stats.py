@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+
+from gridfs.errors import NoFile
+
+from gridfs_writer import iter_rows
+from segments import segment_chain
+
+DEFAULT_KEYWORDS = ["data", "social", "sentiment"]
+MAX_KEYWORDS = int(os.getenv("HISTORY_MAX_KEYWORDS", 20))
+
+# Everything /user-history shows, so it never has to open a blob
+HISTORY_FIELDS = {"_id": 0, "platform": 1, "query": 1, "csv_blob_id": 1, "filename": 1,
+                  "upload_time": 1, "file_size": 1, "row_count": 1, "keyword_count": 1}
+
+
+class KeywordCounter:
+    """Counts the rows that mention each keyword (case-insensitive substring)."""
+
+    def __init__(self, keywords):
+        self.row_count = 0
+        self.counts = {k: 0 for k in keywords}
+
+    def update(self, rows):
+        self.row_count += len(rows)
+        if not self.counts:
+            return
+        for row in rows:
+            line = ",".join("" if v is None else str(v) for v in row).lower()
+            for keyword in self.counts:
+                if keyword in line:
+                    self.counts[keyword] += 1
+
+
+def normalize_keywords(keywords):
+    """Lowercased, de-duplicated keywords; raises ValueError on invalid input.
+
+    Keywords are stored as field names under keyword_count, so "." and a
+    leading "$" are not allowed.
+    """
+    if not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords):
+        raise ValueError("keywords must be a list of strings")
+    keywords = list(dict.fromkeys(k.strip().lower() for k in keywords if k.strip()))
+    if len(keywords) > MAX_KEYWORDS:
+        raise ValueError(f"At most {MAX_KEYWORDS} keywords are allowed")
+    if any("." in k or k.startswith("$") for k in keywords):
+        raise ValueError("Keywords may not contain '.' or start with '$'")
+    return keywords
+
+
+def user_keywords(user_keys_col, email):
+    keys = user_keys_col.find_one({"email": email}, {"history_keywords": 1}) or {}
+    return keys.get("history_keywords", DEFAULT_KEYWORDS)
+
+
+def scrape_stats(out, counter):
+    """History fields for a scrape written through a closed DatasetWriter."""
+    return {
+        "filename": out.filename,
+        "file_size": out.length,
+        "upload_time": out.upload_date,
+        "row_count": counter.row_count,
+        "keyword_count": counter.counts,
+    }
+
+
+def count_blob(fs, blob, keywords):
+    counter = KeywordCounter(keywords)
+    for segment in segment_chain(fs, blob):
+        for page in iter_rows(segment):
+            counter.update(page)
+    return counter
+
+
+def fill_missing_stats(history_col, fs, entry, keywords):
+    """Computes whatever stats entry lacks and stores them on it.
+
+    Entries written before stats were recorded get all of them; entries that
+    only lack some of the user's keywords get just those counted. Returns the
+    updated entry. The blob is read at most once and only when needed.
+    An entry whose file, or one of its segments, is gone comes back as is
+    with "missing" set.
+    """
+    counts = entry.get("keyword_count") or {}
+    missing = [k for k in keywords if k not in counts]
+    if "row_count" in entry and not missing:
+        return entry
+
+    try:
+        blob = fs.get(entry["csv_blob_id"])
+        counter = count_blob(fs, blob, missing)
+    except NoFile:
+        return {**entry, "missing": True}
+    update = {f"keyword_count.{k}": n for k, n in counter.counts.items()}
+    if "row_count" not in entry:
+        update.update({
+            "filename": blob.filename,
+            "file_size": blob.length,
+            "upload_time": blob.upload_date,
+            "row_count": counter.row_count,
+        })
+    history_col.update_one({"csv_blob_id": entry["csv_blob_id"]}, {"$set": update})
+
+    entry = {**entry, **{k: v for k, v in update.items() if not k.startswith("keyword_count.")}}
+    entry["keyword_count"] = {**counts, **counter.counts}
+    return entry
+
+
+def refresh_user_keywords(history_col, fs, email, keywords):
+    """Counts newly added keywords across a user's history; existing counts are kept."""
+    if not keywords:
+        return 0
+    query = {"email": email, "$or": [{f"keyword_count.{k}": {"$exists": False}} for k in keywords]}
+    entries = list(history_col.find(query, {"csv_blob_id": 1, "row_count": 1, "keyword_count": 1}))
+    for entry in entries:
+        fill_missing_stats(history_col, fs, entry, keywords)
+    return len(entries)
+
+
+def backfill(history_col, user_keys_col, fs):
+    """Stores stats on every history entry written before they were recorded."""
+    done = 0
+    for entry in history_col.find({"row_count": {"$exists": False}}):
+        try:
+            fill_missing_stats(history_col, fs, entry, user_keywords(user_keys_col, entry.get("email")))
+        except Exception as e:
+            print(f"Skipping {entry['csv_blob_id']}: {e}", file=sys.stderr)
+            continue
+        done += 1
+    return done
+
+
+def format_entry(entry, keywords):
+    upload_time = entry.get("upload_time")
+    counts = entry.get("keyword_count") or {}
+    return {
+        "platform": entry.get("platform", ""),
+        "query": entry.get("query", ""),
+        "csv_blob_id": str(entry["csv_blob_id"]),
+        "filename": entry.get("filename"),
+        "uploaded_at": upload_time.strftime("%Y-%m-%d %H:%M:%S") if upload_time else None,
+        "file_size": entry.get("file_size"),
+        "row_count": entry.get("row_count"),
+        "keyword_count": {k: counts.get(k, 0) for k in keywords},
+        "missing": entry.get("missing", False),
+    }
+
+
+if __name__ == "__main__":
+    # python history_stats.py -- one-off backfill for entries scraped before
+    # stats were stored at scrape time
+    import gridfs
+    from dotenv import load_dotenv
+
+    import datastore
+
+    load_dotenv()
+    _, db = datastore.connect(os.environ["MONGODB_URI"])
+    started = time.time()
+    count = backfill(db["user_history"], db["user_keys"], gridfs.GridFS(db))
+    print(f"Backfilled {count} history entries in {time.time() - started:.1f}s")
@@ -0,0 +1,97 @@
+import os
+
+from pymongo import ReturnDocument
+
+# Comment ids remembered per video or post, newest kept. They only need to
+# cover comments near the high-water mark (YouTube) or still in the listing
+# (Reddit), so older ones can be forgotten. Every video's or post's ids live
+# in its scrape's state document, which MongoDB caps at 16 MB.
+SCRAPE_SEEN_MAX = int(os.getenv("SCRAPE_SEEN_MAX", 5000))
+
+
+class RunMarks:
+    """High-water marks of the rows written by one scrape, per video or post.
+
+    walks is filled by the YouTube fetcher with the mark each video's comment
+    walk ended with; see youtube_fetch.iter_video_pages.
+    """
+
+    def __init__(self, columns, item_column, id_column, time_column):
+        self._item = columns.index(item_column)
+        self._id = columns.index(id_column)
+        self._time = columns.index(time_column)
+        self.items = {}
+        self.walks = {}
+
+    def update(self, rows):
+        for row in rows:
+            mark = self.items.setdefault(row[self._item], {"hwm": None, "ids": []})
+            if mark["hwm"] is None or row[self._time] > mark["hwm"]:
+                mark["hwm"] = row[self._time]
+            mark["ids"].append(row[self._id])
+
+
+class ScrapeState:
+    """Where each incremental scrape left off.
+
+    scrape_state has one document per (email, platform, query) naming the
+    newest segment of its dataset, with a mark per video or post: the newest
+    comment time up to which everything is stored, the ids of stored
+    comments, where an unfinished YouTube walk resumes and, for Reddit, the
+    post's comment count when it was last crawled.
+    """
+
+    def __init__(self, db):
+        self.states = db["scrape_state"]
+        self.states.create_index([("email", 1), ("platform", 1), ("query", 1)], unique=True)
+        self.states.create_index("head_blob_id")
+
+    def open(self, email, platform, query):
+        """The state document for a scrape, created empty on first use."""
+        return self.states.find_one_and_update(
+            {"email": email, "platform": platform, "query": query},
+            {"$setOnInsert": {"head_blob_id": None, "marks": {}}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def load_marks(self, state, item_ids=None):
+        """{item_id: {"hwm", "seen", "resume", "num_comments"}} for the state's videos or posts."""
+        marks = state.get("marks") or {}
+        if item_ids is not None:
+            marks = {item_id: marks[item_id] for item_id in item_ids if item_id in marks}
+        return {
+            item_id: {"hwm": m.get("hwm"), "seen": set(m.get("seen", ())), "resume": m.get("resume"),
+                      "num_comments": m.get("num_comments")}
+            for item_id, m in marks.items()
+        }
+
+    def advance(self, state, blob_id, run_marks, comment_counts=None):
+        """Makes blob_id the newest segment and folds in the run's marks.
+
+        Head and marks are written in one update, and only if no other run
+        has moved the head since state was read; returns whether they were.
+        A run that stored nothing passes the current head as blob_id.
+        """
+        comment_counts = comment_counts or {}
+        update = {"$set": {"head_blob_id": blob_id}}
+        for item_id in set(run_marks.items) | set(run_marks.walks) | set(comment_counts):
+            path = f"marks.{item_id}"
+            mark = run_marks.items.get(item_id)
+            walk = run_marks.walks.get(item_id)
+            if walk is not None:
+                update["$set"][f"{path}.hwm"] = walk["hwm"]
+                update["$set"][f"{path}.resume"] = walk["resume"]
+            elif mark:
+                update.setdefault("$max", {})[f"{path}.hwm"] = mark["hwm"]
+            if mark:
+                update.setdefault("$push", {})[f"{path}.seen"] = {"$each": mark["ids"], "$slice": -SCRAPE_SEEN_MAX}
+            if item_id in comment_counts:
+                update["$set"][f"{path}.num_comments"] = comment_counts[item_id]
+        return self.states.update_one(
+            {"_id": state["_id"], "head_blob_id": state["head_blob_id"]}, update,
+        ).matched_count == 1
+
+    def drop_chain(self, head_blob_id):
+        """Forgets the scrape whose newest segment is head_blob_id, if any."""
+        self.states.delete_one({"head_blob_id": head_blob_id})
@@ -1,32 +1,50 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from pymongo import MongoClient
 import gridfs
+from gridfs.errors import NoFile
 from bson import ObjectId
-import pandas as pd
-import praw
 import os
-from io import BytesIO
-from googleapiclient.discovery import build
+import threading
+from datetime import datetime
 from dotenv import load_dotenv
+import datastore
+import history_stats
+import incremental
+import metrics
+import reddit_crawl
+import youtube_fetch
+from clients import ClientPool, QuotaExceeded, consume_quota
+from gridfs_writer import FORMATS, DatasetWriter, iter_dataset_csv
+from reddit_crawl import iter_crawl_pages
+from segments import segment_chain
+from youtube_fetch import execute, iter_comment_pages
 
 # --- Setup ---
 load_dotenv()
 app = Flask(__name__)
 CORS(app)
+# Request latency and stage timings, served on /metrics
+metrics.instrument(app)
 
 # MongoDB
 mongo_uri = os.getenv("MONGODB_URI")
 if not mongo_uri:
     raise Exception("❌ MONGODB_URI not found. Make sure it's set in Render environment.")
 
-client = MongoClient(mongo_uri)
-db = client["SocialAnalysis"]
+client, db = datastore.connect(mongo_uri)
+datastore.ensure_indexes(db)
 fs = gridfs.GridFS(db)
+fs_bucket = gridfs.GridFSBucket(db)  # same files as fs, used for streaming uploads
 
 # Collections
 user_keys_col = db["user_keys"]
 user_history_col = db["user_history"]
+# Written by the analysis service (results, aggregate partials and rendered
+# images); entries for a blob are dropped when it is deleted
+analysis_cache_col = db["analysis_cache"]
+aggregate_partials_col = db["aggregate_partials"]
+artifact_fs = gridfs.GridFS(db, collection="artifacts")
+scrape_state = incremental.ScrapeState(db)
 
 # Default API Keys (from .env)
 DEFAULT_YOUTUBE_API = os.getenv("YOUTUBE_API_KEY")
@@ -39,83 +57,123 @@ DEFAULT_REDDIT_USE_COUNT = 10
 
 # ========== API KEY HANDLING ==========
 
-def get_user_keys(email):
-    keys = user_keys_col.find_one({"email": email})
-    return keys or {}
+# The API client libraries are imported with the first client built, so
+# starting the service does not wait on them
+def build_youtube_client(key):
+    from googleapiclient.discovery import build
+
+    return build('youtube', 'v3', developerKey=key)
+
+
+def build_reddit_client(client_id, secret, agent, _thread):
+    import praw
+
+    return praw.Reddit(
+        client_id=client_id,
+        client_secret=secret,
+        user_agent=agent
+    )
+
+
+# Clients are reused across requests per credential set. praw.Reddit must not
+# be shared between threads, so Reddit clients are also keyed by thread.
+youtube_clients = ClientPool(build_youtube_client)
+reddit_clients = ClientPool(build_reddit_client)
 
 def get_youtube_client(email):
-    user_keys = get_user_keys(email)
+    # Takes one use of the user's quota and fetches their key in one round trip
+    try:
+        youtube_use_count, user_keys = consume_quota(
+            user_keys_col, email, "youtube_use_count", fields=["youtube_api"])
+    except QuotaExceeded:
+        raise QuotaExceeded("YouTube API usage limit reached. Please refresh or use your own key.")
     youtube_api_key = user_keys.get("youtube_api", DEFAULT_YOUTUBE_API)
-    youtube_use_count = user_keys.get("youtube_use_count", "unlimited")
-
-    # If "unlimited", treat it as 100000 for comparison
-    if youtube_use_count == "unlimited":
-        youtube_use_count = 100000  # Treat as infinite (large number)
-        youtube_client = build('youtube', 'v3', developerKey=youtube_api_key)
-        return youtube_client, youtube_use_count
-    else:
-        youtube_use_count = int(youtube_use_count)  # Convert to integer if it's a number
-
-        if youtube_use_count > 0:
-            # Process the youtube API client initialization
-            youtube_client = build('youtube', 'v3', developerKey=youtube_api_key)
-            youtube_use_count -= 1  # Decrease the count as it was used
-    
-            # Update the youtube use count in the database
-            user_keys_col.update_one(
-                {"email": email},
-                {"$set": {"youtube_use_count": youtube_use_count}},
-            )
-            return youtube_client, youtube_use_count
-        else:
-            raise Exception("YouTube API usage limit reached. Please refresh or use your own key.")
+    return youtube_clients.get(youtube_api_key), youtube_use_count
 
 
+def reddit_client_factory(user_keys):
+    """Per-thread Reddit clients for the given user's credentials."""
+    credentials = (
+        user_keys.get("reddit_client_id", DEFAULT_REDDIT_ID),
+        user_keys.get("reddit_secret", DEFAULT_REDDIT_SECRET),
+        user_keys.get("reddit_user_agent", DEFAULT_USER_AGENT),
+    )
+    return lambda: reddit_clients.get(*credentials, threading.get_ident())
 
-def get_reddit_client(email):
-    # Fetch user API keys from the database
-    user_keys = get_user_keys(email)
-    reddit_client_id = user_keys.get("reddit_client_id", DEFAULT_REDDIT_ID)
-    reddit_client_secret = user_keys.get("reddit_secret", DEFAULT_REDDIT_SECRET)
-    reddit_user_agent = user_keys.get("reddit_user_agent", DEFAULT_USER_AGENT)
-    reddit_use_count = user_keys.get("reddit_use_count", "unlimited")
-
-    # If reddit_use_count is "unlimited", treat it as 100000 (or another large number)
-    if reddit_use_count == "unlimited":
-        reddit_use_count = 100000  # Treat "unlimited" as a very large number
-        reddit_client = praw.Reddit(
-                client_id=reddit_client_id,
-                client_secret=reddit_client_secret,
-                user_agent=reddit_user_agent
-        )
-        return reddit_client, reddit_use_count
-
-    else:
-        reddit_use_count = int(reddit_use_count)  # Convert it to an integer for comparison
-    
-        # Check if we still have use left for the Reddit API
-        if reddit_use_count > 0:
-            # Initialize the Reddit client using PRAW
-            reddit_client = praw.Reddit(
-                client_id=reddit_client_id,
-                client_secret=reddit_client_secret,
-                user_agent=reddit_user_agent
-            )
-            
-            # Decrease the usage count as it is being used
-            reddit_use_count -= 1
-            
-            # Update the use count in the database
-            user_keys_col.update_one(
-                {"email": email},
-                {"$set": {"reddit_use_count": reddit_use_count}},
-            )
-    
-            return reddit_client, reddit_use_count
-        else:
-            raise Exception("Reddit API usage limit reached. Please refresh or use your own key.")
 
+def get_reddit_client(email):
+    try:
+        reddit_use_count, user_keys = consume_quota(
+            user_keys_col, email, "reddit_use_count",
+            fields=["reddit_client_id", "reddit_secret", "reddit_user_agent"])
+    except QuotaExceeded:
+        raise QuotaExceeded("Reddit API usage limit reached. Please refresh or use your own key.")
+    factory = reddit_client_factory(user_keys)
+    return factory(), reddit_use_count, factory
+
+
+
+
+# ========== SCRAPE RESULTS ==========
+def wants_incremental():
+    return request.args.get("incremental", "").lower() in ("1", "true", "yes")
+
+
+def new_dataset(filename, source, file_format, state=None):
+    """A writer for a scrape's rows; an incremental run's links to the dataset it extends."""
+    previous = state and state["head_blob_id"]
+    return DatasetWriter(fs_bucket, filename, source.COMMENT_COLUMNS, file_format,
+                         types=source.COLUMN_TYPES, text_column=source.TEXT_COLUMN,
+                         metadata={"previous_blob_id": previous} if previous else None)
+
+
+def record_scrape(email, platform, query, out, stats, state=None, run_marks=None, comment_counts=None):
+    """Adds a finished scrape to the user's history and returns its dataset's blob id.
+
+    An incremental run's segment is folded into the history entry of the
+    dataset it extends, which then points at the new segment. A run that
+    found nothing new writes no segment.
+    """
+    previous = state and state["head_blob_id"]
+    if previous and not stats.row_count:
+        scrape_state.advance(state, previous, run_marks, comment_counts)
+        return previous
+
+    if previous:
+        entry = user_history_col.find_one({"csv_blob_id": previous}, {"keyword_count": 1})
+        if entry is not None and scrape_state.advance(state, out.file_id, run_marks, comment_counts):
+            counted = entry.get("keyword_count") or {}
+            user_history_col.update_one({"_id": entry["_id"]}, {
+                "$set": {"csv_blob_id": out.file_id, "upload_time": out.upload_date},
+                "$inc": {
+                    "file_size": out.length,
+                    "row_count": stats.row_count,
+                    "segments": 1,
+                    # Keywords the entry was never counted for are filled in over
+                    # the whole dataset by /user-history
+                    **{f"keyword_count.{k}": n for k, n in stats.counts.items() if k in counted},
+                },
+            })
+            return out.file_id
+        # Another run of the same scrape moved on first: keep this segment as
+        # its own entry, with stats left to be counted over its whole chain
+        user_history_col.insert_one({
+            "email": email, "platform": platform, "query": query, "csv_blob_id": out.file_id,
+            "filename": out.filename, "upload_time": out.upload_date,
+        })
+        return out.file_id
 
+    user_history_col.insert_one({
+        "email": email,
+        "platform": platform,
+        "query": query,
+        "csv_blob_id": out.file_id,
+        **history_stats.scrape_stats(out, stats),
+        **({"segments": 1} if state is not None else {}),
+    })
+    if state is not None:
+        scrape_state.advance(state, out.file_id, run_marks, comment_counts)
+    return out.file_id
 
 
 # ========== SAVE API KEY ==========
@@ -203,13 +261,21 @@ def scrape_youtube():
     comment_limit = int(request.args.get("comment_limit", 100))
     
     # Get custom filename or fallback to default
-    custom_filename = request.args.get("filename", f"{email}_youtube_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    custom_filename = request.args.get("filename", f"{email}_youtube_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    file_format = request.args.get("format", "csv")
+    if file_format not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
 
-    YOUTUBE, youtube_use_count = get_youtube_client(email)
+    try:
+        YOUTUBE, youtube_use_count = get_youtube_client(email)
+    except QuotaExceeded as e:
+        return jsonify({"error": str(e)}), 429
 
     video_ids = [v.strip() for v in raw_ids.split(',') if v.strip()]
+    incremental_run = wants_incremental()
+    scrape_key = "|".join([query, *sorted(video_ids)])
     if query:
-        result = YOUTUBE.search().list(q=query, part="id", maxResults=search_limit, type="video").execute()
+        result = execute(YOUTUBE.search().list(q=query, part="id", maxResults=search_limit, type="video"))
         for item in result.get("items", []):
             vid = item["id"]["videoId"]
             if vid not in video_ids:
@@ -218,31 +284,36 @@ def scrape_youtube():
     if not video_ids:
         return jsonify({"error": "No video IDs found"}), 400
 
-    rows = [["video_id", "author_name", "comment", "published_at", "likes", "reply_count"]]
-    for vid in video_ids:
-        data = YOUTUBE.commentThreads().list(
-            part="snippet", videoId=vid, maxResults=comment_limit, textFormat="plainText"
-        ).execute()
-        for item in data.get("items", []):
-            top = item['snippet']['topLevelComment']['snippet']
-            rows.append([vid, top['authorDisplayName'], top['textDisplay'],
-                         top['publishedAt'], top['likeCount'], item['snippet']['totalReplyCount']])
-
-    df = pd.DataFrame(rows[1:], columns=rows[0])
-    csv_bytes = df.to_csv(index=False).encode()
-    
-    # Save with the custom or default filename
-    blob_id = fs.put(csv_bytes, filename=custom_filename)
-    
-    # Insert file history in the DB
-    user_history_col.insert_one({
-        "email": email,
-        "platform": "youtube",
-        "query": query,
-        "csv_blob_id": blob_id
-    })
-
-    return jsonify({"status": "success", "blob_id": str(blob_id), "youtube_use_count": youtube_use_count}), 200
+    # An incremental scrape only fetches comments newer than the last run of
+    # the same query and stores them as a segment of that run's dataset
+    state = marks = run_marks = None
+    if incremental_run:
+        state = scrape_state.open(email, "youtube", scrape_key)
+        marks = scrape_state.load_marks(state, video_ids)
+        run_marks = incremental.RunMarks(youtube_fetch.COMMENT_COLUMNS, "video_id", "comment_id", "published_at")
+
+    # Pages through each video's threads up to comment_limit, videos in parallel,
+    # writing each page to GridFS as it arrives. History stats are counted on
+    # the same pages so /user-history never has to reread the file.
+    stats = history_stats.KeywordCounter(history_stats.user_keywords(user_keys_col, email))
+    with new_dataset(custom_filename, youtube_fetch, file_format, state) as out:
+        # scrape_wait is the time spent waiting on the fetch threads
+        pages = iter_comment_pages(YOUTUBE, video_ids, comment_limit, marks=marks,
+                                   walks=run_marks.walks if run_marks else None)
+        for page in metrics.timed_iter("scrape_wait", pages):
+            out.write_rows(page)
+            stats.update(page)
+            if run_marks:
+                run_marks.update(page)
+        if state and state["head_blob_id"] and not stats.row_count:
+            out.abort()
+    blob_id = record_scrape(email, "youtube", query, out, stats, state, run_marks)
+    metrics.count("youtube_rows", stats.row_count)
+
+    response = {"status": "success", "blob_id": str(blob_id), "youtube_use_count": youtube_use_count}
+    if incremental_run:
+        response["new_rows"] = stats.row_count
+    return jsonify(response), 200
 
 
 
@@ -258,82 +329,94 @@ def scrape_reddit():
     comment_limit = int(request.args.get("comment_limit", 20))
 
     # Get custom filename or fallback to default
-    custom_filename = request.args.get("filename", f"{email}_reddit_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    custom_filename = request.args.get("filename", f"{email}_reddit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    file_format = request.args.get("format", "csv")
+    if file_format not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
 
-    REDDIT, reddit_use_count = get_reddit_client(email)
+    try:
+        REDDIT, reddit_use_count, reddit_factory = get_reddit_client(email)
+    except QuotaExceeded as e:
+        return jsonify({"error": str(e)}), 429
 
     if not query:
         return jsonify({"error": "No query provided"}), 400
 
-    subs = [sr.display_name for sr in REDDIT.subreddits.search(query, limit=sub_limit)]
-    posts = []
-    for sub in subs:
-        for s in REDDIT.subreddit(sub).search(query, limit=post_limit):
-            posts.append((s.url, s))
-
-    rows = [["Post URL", "Comment"]]
-    for url, post in posts:
-        post.comments.replace_more(limit=0)
-        for c in post.comments.list()[:comment_limit]:
-            rows.append([url, c.body])
-
-    df = pd.DataFrame(rows[1:], columns=rows[0])
-    csv_bytes = df.to_csv(index=False).encode()
-
-    # Save with the custom or default filename
-    blob_id = fs.put(csv_bytes, filename=custom_filename)
-
-    # Insert file history in the DB
-    user_history_col.insert_one({
-        "email": email,
-        "platform": "reddit",
-        "query": query,
-        "csv_blob_id": blob_id
-    })
-
-    return jsonify({"status": "success", "blob_id": str(blob_id), "reddit_use_count": reddit_use_count}), 200
-
-
-
-
-# In the user-history route, add file size and keyword stats:
+    # An incremental scrape skips comments stored by earlier runs of the same
+    # query, and posts with no new comments since, and stores the rest as a
+    # segment of that run's dataset
+    state = marks = run_marks = comment_counts = None
+    if wants_incremental():
+        state = scrape_state.open(email, "reddit", query)
+        marks = scrape_state.load_marks(state)
+        run_marks = incremental.RunMarks(reddit_crawl.COMMENT_COLUMNS, "post_id", "comment_id", "created_utc")
+        comment_counts = {}
+
+    # Subreddit searches and comment trees are fetched concurrently; posts found
+    # in more than one subreddit are crawled once. Each post's comments are
+    # written to GridFS as they arrive, and counted for the history stats.
+    stats = history_stats.KeywordCounter(history_stats.user_keywords(user_keys_col, email))
+    with new_dataset(custom_filename, reddit_crawl, file_format, state) as out:
+        pages = iter_crawl_pages(REDDIT, query, sub_limit, post_limit, comment_limit,
+                                 factory=reddit_factory, marks=marks, comment_counts=comment_counts)
+        for page in metrics.timed_iter("scrape_wait", pages):
+            out.write_rows(page)
+            stats.update(page)
+            if run_marks:
+                run_marks.update(page)
+        if state and state["head_blob_id"] and not stats.row_count:
+            out.abort()
+    blob_id = record_scrape(email, "reddit", query, out, stats, state, run_marks, comment_counts)
+    metrics.count("reddit_rows", stats.row_count)
+
+    response = {"status": "success", "blob_id": str(blob_id), "reddit_use_count": reddit_use_count}
+    if state is not None:
+        response["new_rows"] = stats.row_count
+    return jsonify(response), 200
+
+
+
+
+# ========== USER HISTORY ==========
 @app.route('/user-history', methods=['GET'])
 def user_history():
     email = request.args.get("email")
-    history = list(user_history_col.find({"email": email}))
+    keywords = history_stats.user_keywords(user_keys_col, email)
+    # Stats are stored on each entry at scrape time; only entries from before
+    # that (or lacking a newly added keyword) read their blob, once
+    history = user_history_col.find({"email": email}, history_stats.HISTORY_FIELDS).sort("upload_time", -1)
     formatted = []
     for item in history:
-        blob_id = item["csv_blob_id"]
-        blob = fs.get(blob_id)
-        uploaded_time = blob.upload_date.strftime("%Y-%m-%d %H:%M:%S")
-        file_size = blob.length  # File size in bytes
-        keyword_count = get_keyword_count(blob)  # You can define this function based on your needs
-        formatted.append({
-            "platform": item.get("platform", ""),
-            "query": item.get("query", ""),
-            "csv_blob_id": str(blob._id),
-            "filename": blob.filename,
-            "uploaded_at": uploaded_time,
-            "file_size": file_size,  # Add file size
-            "keyword_count": keyword_count  # Keyword stats
-        })
-    # Sort by most recent first
-    sorted_history = sorted(formatted, key=lambda x: x["uploaded_at"], reverse=True)
-    return jsonify({"history": sorted_history}), 200
-
-# Function to get keyword count (example for YouTube comments)
-def get_keyword_count(blob):
-    content = blob.read().decode('utf-8')  # Read the file
-    rows = content.splitlines()
-    keywords = ["data", "social", "sentiment"]  # Example keywords
-    keyword_count = {keyword: 0 for keyword in keywords}
-    
-    for row in rows:
-        for keyword in keywords:
-            if keyword.lower() in row.lower():
-                keyword_count[keyword] += 1
-    
-    return keyword_count
+        item = history_stats.fill_missing_stats(user_history_col, fs, item, keywords)
+        formatted.append(history_stats.format_entry(item, keywords))
+    return jsonify({"history": formatted}), 200
+
+
+@app.route('/history-keywords', methods=['GET'])
+def get_history_keywords():
+    email = request.args.get("email")
+    if not email:
+        return jsonify({"error": "Email required"}), 400
+    return jsonify({"keywords": history_stats.user_keywords(user_keys_col, email)}), 200
+
+
+@app.route('/history-keywords', methods=['POST'])
+def save_history_keywords():
+    data = request.json or {}
+    email = data.get("email")
+    if not email:
+        return jsonify({"error": "Email required"}), 400
+    try:
+        keywords = history_stats.normalize_keywords(data.get("keywords"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user_keys_col.update_one({"email": email}, {"$set": {"history_keywords": keywords}}, upsert=True)
+    # Only keywords no entry has been counted for yet need the files reread;
+    # removed keywords just stop being shown
+    threading.Thread(target=history_stats.refresh_user_keywords, daemon=True,
+                     args=(user_history_col, fs, email, keywords)).start()
+    return jsonify({"keywords": keywords}), 200
 
 
 # ========== DOWNLOAD CSV ==========
@@ -341,7 +424,11 @@ def get_keyword_count(blob):
 def download_csv(blob_id):
     try:
         blob = fs.get(ObjectId(blob_id))
-        return send_file(BytesIO(blob.read()), download_name=blob.filename, as_attachment=True)
+        # Served as plain CSV whatever the stored format, streamed from GridFS;
+        # an incrementally scraped dataset comes out as one file
+        return Response(iter_dataset_csv(fs, blob), mimetype="text/csv", headers={
+            "Content-Disposition": f'attachment; filename="{blob.filename}"'
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
@@ -351,18 +438,34 @@ def get_scraped_files():
     if not email:
         return jsonify({"error": "Email is required"}), 400
 
-    history = list(user_history_col.find({"email": email}).sort("upload_time", -1))
+    history = list(user_history_col.find({"email": email}, datastore.SCRAPED_FILE_FIELDS).sort("upload_time", -1))
     for entry in history:
         entry["_id"] = str(entry["_id"])
         entry["csv_blob_id"] = str(entry["csv_blob_id"])
-        entry["upload_time"] = entry["upload_time"].isoformat()
+        # Entries from before upload times were stored have none until backfilled
+        if entry.get("upload_time"):
+            entry["upload_time"] = entry["upload_time"].isoformat()
     return jsonify(history), 200
 
 @app.route('/delete-file/<blob_id>', methods=['DELETE'])
 def delete_file(blob_id):
     try:
-        fs.delete(ObjectId(blob_id))
+        # An incrementally scraped dataset goes with all its earlier segments.
+        # If the file is already gone, its history entry and cached results
+        # are still cleaned up.
+        try:
+            segment_ids = [segment._id for segment in segment_chain(fs, fs.get(ObjectId(blob_id)))]
+        except NoFile:
+            segment_ids = [ObjectId(blob_id)]
+        for segment_id in segment_ids:
+            fs.delete(segment_id)
         user_history_col.delete_one({"csv_blob_id": ObjectId(blob_id)})
+        scrape_state.drop_chain(ObjectId(blob_id))
+        segment_keys = [str(segment_id) for segment_id in segment_ids]
+        analysis_cache_col.delete_many({"blob_id": {"$in": segment_keys}})
+        aggregate_partials_col.delete_many({"blob_id": {"$in": segment_keys}})
+        for artifact in artifact_fs.find({"metadata.blob_id": {"$in": segment_keys}}):
+            artifact_fs.delete(artifact._id)
         return jsonify({"message": "File deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
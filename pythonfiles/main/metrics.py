@@ -0,0 +1,349 @@
+# Shared by both services: analysis/ and main/ each hold an identical copy,
+# as each deploys from its own directory. Edit both together;
+# benchmarks/check_shared_modules.py fails when they differ.
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, request
+from pymongo import monitoring
+
+log = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Opt-in sampling profiler: requests taking longer than this many seconds
+# have their most frequently sampled stacks logged; 0 leaves it off
+PROFILE_SLOW_SECONDS = float(os.getenv("METRICS_PROFILE_SLOW_SECONDS", 0))
+PROFILE_INTERVAL = float(os.getenv("METRICS_PROFILE_INTERVAL", 0.005))
+PROFILE_STACKS = int(os.getenv("METRICS_PROFILE_STACKS", 5))
+PROFILE_DEPTH = int(os.getenv("METRICS_PROFILE_DEPTH", 30))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = [*zip(self.labelnames, key), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{self._labels(key)} {_format(value)}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (the last past every bound), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                yield f"{self.name}_bucket{self._labels(key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {_format(total)}"
+            yield f"{self.name}_count{self._labels(key)} {count}"
+
+
+class Registry:
+    """The metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to serve a request.", ("method", "route", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent in one stage of serving a request or job.", ("stage",))
+EVENTS = REGISTRY.counter("events_total", "Things that happened, such as cache hits.", ("event",))
+
+
+# ========== STAGE TIMERS ==========
+
+class Timings:
+    """Seconds spent in each stage, summed, for one request's breakdown."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Times the block as stage, in the stage histogram and the current
+    request's breakdown.
+
+    Stages nest and may overlap: a stage includes any stage timed inside
+    it, and stages timed on several threads at once can add up to more than
+    the request took.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed_iter(stage, iterable):
+    """Yields from iterable, timing the wait for each item as stage."""
+    items = iter(iterable)
+    while True:
+        with timed(stage):
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(event, amount=1):
+    EVENTS.inc(amount, event=event)
+
+
+@contextmanager
+def collect():
+    """Collects the stages timed inside the block; yields their {stage: seconds}.
+
+    Jobs return this from their worker process so the web process can
+    record() them, as its /metrics never sees the workers' own registries.
+    """
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings.stages
+    finally:
+        _timings.reset(token)
+
+
+def record(stages):
+    """Observes {stage: seconds} measured elsewhere."""
+    for stage, seconds in stages.items():
+        observe(stage, seconds)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every MongoDB command as a mongo_<command> stage.
+
+    Listeners are called on the thread running the command, so the time
+    shows up in that request's breakdown too.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe(f"mongo_{event.command_name}", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        observe(f"mongo_{event.command_name}", event.duration_micros / 1e6)
+        count(f"mongo_{event.command_name}_failed")
+
+
+# ========== SAMPLING PROFILER ==========
+
+def _stack(frame):
+    # Innermost PROFILE_DEPTH frames, outermost first
+    stack = []
+    while frame is not None and len(stack) < PROFILE_DEPTH:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving requests every interval seconds.
+
+    One background thread, started on first use, samples the registered
+    threads; each request's samples live only until it ends.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._threads = {}  # thread id -> Tally of stacks
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start(self):
+        with self._lock:
+            self._threads[threading.get_ident()] = Tally()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name="metrics-profiler", daemon=True)
+                self._sampler.start()
+
+    def stop(self):
+        with self._lock:
+            return self._threads.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._threads.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_stack(frame)] += 1
+
+
+def _report_slow(method, path, elapsed, samples):
+    total = sum(samples.values())
+    lines = [f"Slow request {method} {path} took {elapsed:.2f}s; top stacks of {total} samples:"]
+    for stack, n in samples.most_common(PROFILE_STACKS):
+        lines.append(f"  {n} ({n / total:.0%})")
+        lines.extend(f"    {frame}" for frame in stack)
+    log.warning("\n".join(lines))
+
+
+profiler = SamplingProfiler() if PROFILE_SLOW_SECONDS > 0 else None
+
+
+# ========== FLASK ==========
+
+def _wants_timings():
+    return request.args.get("timings", "").lower() in ("1", "true", "yes")
+
+
+def _attach(response, stages, elapsed):
+    stages = {**stages, "total": elapsed}
+    response.headers["Server-Timing"] = ", ".join(f"{s};dur={t * 1000:.1f}" for s, t in stages.items())
+    if response.is_json and not response.is_streamed:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body["timings"] = {s: round(t, 6) for s, t in stages.items()}
+            response.set_data(current_app.json.dumps(body))
+
+
+def instrument(app):
+    """Times every request of app by route and status, and serves GET /metrics.
+
+    With ?timings=1 the stages timed while serving a request come back in
+    a Server-Timing header and, in a JSON object body, under "timings".
+    """
+
+    @app.before_request
+    def _start_request():
+        g.metrics_start = time.perf_counter()
+        if _wants_timings():
+            g.metrics_timings = Timings()
+            g.metrics_token = _timings.set(g.metrics_timings)
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def _finish_request(response):
+        elapsed = time.perf_counter() - g.get("metrics_start", time.perf_counter())
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        timings = g.get("metrics_timings")
+        if timings is not None:
+            _attach(response, timings.stages, elapsed)
+        return response
+
+    @app.teardown_request
+    def _end_request(error=None):
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            _timings.reset(token)
+        if profiler is not None:
+            samples = profiler.stop()
+            elapsed = time.perf_counter() - g.get("metrics_start", time.perf_counter())
+            if samples and elapsed >= PROFILE_SLOW_SECONDS:
+                _report_slow(request.method, request.full_path, elapsed, samples)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,108 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fanout import iter_pages
+from metrics import timed
+from ratelimit import TokenBucket
+
+REDDIT_CRAWL_WORKERS = int(os.getenv("REDDIT_CRAWL_WORKERS", 4))
+# Reddit allows ~100 OAuth requests per minute per client
+REDDIT_REQUESTS_PER_SECOND = float(os.getenv("REDDIT_REQUESTS_PER_SECOND", 1.5))
+
+# "Post URL" and "Comment" stay first so existing files and readers line up
+COMMENT_COLUMNS = ["Post URL", "Comment", "subreddit", "post_id", "post_score",
+                   "comment_id", "parent_id", "author", "score", "created_utc"]
+COLUMN_TYPES = {"post_score": int, "score": int, "created_utc": float}
+TEXT_COLUMN = "Comment"
+
+reddit_rate_limit = TokenBucket(REDDIT_REQUESTS_PER_SECOND)
+
+
+def clone_factory(reddit):
+    """Per-thread Reddit instances with the same credentials.
+
+    A praw.Reddit instance must not be shared between threads.
+    """
+    local = threading.local()
+
+    def factory():
+        if not hasattr(local, "reddit"):
+            import praw
+
+            local.reddit = praw.Reddit(
+                client_id=reddit.config.client_id,
+                client_secret=reddit.config.client_secret,
+                user_agent=reddit.config.user_agent,
+            )
+        return local.reddit
+
+    return factory
+
+
+def _search_posts(factory, sub, query, limit, bucket):
+    bucket.acquire()
+    with timed("reddit_search"):
+        return [(s.id, s.num_comments) for s in factory().subreddit(sub).search(query, limit=limit)]
+
+
+def _comment_rows(factory, post_id, limit, bucket, seen=()):
+    """Rows for up to limit of the post's unseen comments, and whether that was all of them."""
+    bucket.acquire()
+    with timed("reddit_comments"):
+        post = factory().submission(id=post_id)
+        post.comments.replace_more(limit=0)
+        comments = post.comments.list()
+    unseen = [c for c in comments if c.id not in seen]
+    rows = []
+    for c in unseen[:limit]:
+        rows.append([post.url, c.body, post.subreddit.display_name, post.id, post.score,
+                     c.id, c.parent_id, c.author.name if c.author else "[deleted]",
+                     c.score, c.created_utc])
+    return rows, len(unseen) <= limit
+
+
+def iter_crawl_pages(reddit, query, sub_limit, post_limit, comment_limit,
+                     workers=REDDIT_CRAWL_WORKERS, bucket=reddit_rate_limit, factory=None,
+                     marks=None, comment_counts=None):
+    """Pages of comment rows (one per post) for posts matching query in the top
+    matching subreddits.
+
+    Subreddit searches and comment trees are fetched concurrently. A post
+    found through several subreddit searches is crawled once.
+
+    marks maps a post id to the {"seen", "num_comments"} of an earlier
+    scrape: seen comments are skipped, and posts whose comment count has not
+    changed since are not fetched at all. comment_counts, when given, is
+    filled with the comment count of every post crawled in full; a post cut
+    short by comment_limit is left out, so the next run fetches the rest.
+    """
+    marks = marks or {}
+    factory = factory or clone_factory(reddit)
+    bucket.acquire()
+    with timed("reddit_search"):
+        subs = [sr.display_name for sr in reddit.subreddits.search(query, limit=sub_limit)]
+    if not subs:
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        found = [pool.submit(contextvars.copy_context().run,
+                             _search_posts, factory, sub, query, post_limit, bucket) for sub in subs]
+        posts = {}
+        for future in found:
+            for pid, num_comments in future.result():
+                posts.setdefault(pid, num_comments)
+
+    post_ids = [pid for pid, num_comments in posts.items()
+                if (marks.get(pid) or {}).get("num_comments") != num_comments]
+
+    def produce(post_id):
+        seen = (marks.get(post_id) or {}).get("seen", ())
+        rows, complete = _comment_rows(factory, post_id, comment_limit, bucket, seen)
+        if complete and comment_counts is not None:
+            comment_counts[post_id] = posts[post_id]
+        if rows:
+            yield rows
+
+    yield from iter_pages(produce, post_ids, workers)
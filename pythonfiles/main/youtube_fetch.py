@@ -0,0 +1,153 @@
+import os
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from fanout import iter_pages
+from metrics import count, timed
+from ratelimit import TokenBucket
+
+YOUTUBE_FETCH_WORKERS = int(os.getenv("YOUTUBE_FETCH_WORKERS", 4))
+# commentThreads.list costs one quota unit per call; this caps the burst rate
+# of API calls across all requests handled by this process
+YOUTUBE_REQUESTS_PER_SECOND = float(os.getenv("YOUTUBE_REQUESTS_PER_SECOND", 5))
+YOUTUBE_MAX_RETRIES = int(os.getenv("YOUTUBE_MAX_RETRIES", 4))
+YOUTUBE_HTTP_TIMEOUT = int(os.getenv("YOUTUBE_HTTP_TIMEOUT", 30))
+
+PAGE_SIZE = 100  # API maximum for commentThreads.list
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+COMMENT_COLUMNS = ["video_id", "author_name", "comment", "published_at", "likes", "reply_count",
+                   "comment_id"]
+COLUMN_TYPES = {"likes": int, "reply_count": int}
+TEXT_COLUMN = "comment"
+
+youtube_rate_limit = TokenBucket(YOUTUBE_REQUESTS_PER_SECOND)
+
+_local = threading.local()
+
+
+def _thread_http():
+    # The discovery client's default httplib2.Http is not thread-safe, so
+    # every thread executes requests on its own connection
+    if not hasattr(_local, "http"):
+        _local.http = httplib2.Http(timeout=YOUTUBE_HTTP_TIMEOUT)
+    return _local.http
+
+
+def execute(request, retries=YOUTUBE_MAX_RETRIES, backoff=1.0, bucket=youtube_rate_limit):
+    """Execute an API request under the rate limit, retrying transient failures.
+
+    Requests must accept an `http` keyword, as googleapiclient's do.
+    """
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            with timed("youtube_api"):
+                return request.execute(http=_thread_http())
+        except HttpError as e:
+            if e.resp.status not in TRANSIENT_STATUSES or attempt == retries:
+                raise
+        except (OSError, httplib2.HttpLib2Error):
+            if attempt == retries:
+                raise
+        count("youtube_api_retry")
+        time.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+
+
+def _comments_disabled(error):
+    return error.resp.status == 403 and b"commentsDisabled" in (error.content or b"")
+
+
+def _comment_row(video_id, item):
+    top = item['snippet']['topLevelComment']['snippet']
+    return [video_id, top['authorDisplayName'], top['textDisplay'],
+            top['publishedAt'], top['likeCount'], item['snippet']['totalReplyCount'], item['id']]
+
+
+def _later(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+def iter_video_pages(youtube, video_id, limit, bucket=youtube_rate_limit, mark=None, walks=None):
+    """Yields pages of top-level comment rows for one video, up to `limit` rows.
+
+    Without mark, threads come in YouTube's default (relevance) order. mark
+    makes the walk incremental: it is the {"hwm", "seen", "resume"} of
+    earlier runs, empty on the first. Threads are then listed newest first
+    and only ones newer than hwm (the newest published_at with everything
+    before it stored) are returned, paging stopping at the first older one;
+    seen holds the stored comment ids, which drops the ones already fetched
+    above hwm or published in the same second as it.
+
+    hwm only moves once a walk reaches it. A walk cut short by limit keeps
+    it, and resumes next run from the page it stopped at; walks[video_id]
+    is set to the "hwm" and "resume" the video's mark should now have.
+    """
+    incremental = mark is not None
+    mark = mark or {}
+    since, seen, resume = mark.get("hwm"), mark.get("seen", ()), mark.get("resume")
+    # newest is the newest comment of the walk, which may span several runs
+    page_token, newest = (resume["page_token"], resume["top"]) if resume else (None, None)
+    fetched = 0
+    while True:
+        if fetched >= limit:
+            if walks is not None:
+                walks[video_id] = {"hwm": since, "resume": {"page_token": page_token, "top": newest}}
+            return
+        request_token = page_token
+        try:
+            data = execute(youtube.commentThreads().list(
+                part="snippet", videoId=video_id, maxResults=min(PAGE_SIZE, limit - fetched),
+                pageToken=page_token, textFormat="plainText",
+                **({"order": "time"} if incremental else {})
+            ), bucket=bucket)
+        except HttpError as e:
+            if _comments_disabled(e):
+                break
+            if e.resp.status == 400 and resume and request_token == resume["page_token"] and fetched == 0:
+                # A stale resume token: walk from the newest thread again, seen
+                # skipping what the earlier runs stored
+                page_token = newest = resume = None
+                continue
+            raise
+        rows = [_comment_row(video_id, item) for item in data.get("items", [])]
+        page_token = data.get("nextPageToken")
+        caught_up = False
+        if incremental:
+            new = [row for row in rows if since is None or row[3] >= since]
+            caught_up = len(new) < len(rows)
+            rows = [row for row in new if row[-1] not in seen]
+        if len(rows) > limit - fetched:
+            # Carry on from this same page next time; seen skips the rows kept
+            rows = rows[:limit - fetched]
+            page_token, caught_up = request_token, False
+        for row in rows:
+            newest = _later(newest, row[3])
+        fetched += len(rows)
+        if rows:
+            yield rows
+        if not page_token or caught_up:
+            break
+    if walks is not None:
+        walks[video_id] = {"hwm": _later(since, newest), "resume": None}
+
+
+def iter_comment_pages(youtube, video_ids, limit, workers=YOUTUBE_FETCH_WORKERS, bucket=youtube_rate_limit,
+                       marks=None, walks=None):
+    """Pages of comment rows for every video, fetched concurrently.
+
+    Pages arrive in completion order; only a few are buffered at a time.
+    marks, given for an incremental scrape, maps a video id to the mark of
+    earlier runs, whose comments are then skipped, and walks collects the
+    videos' new marks; see iter_video_pages.
+    """
+
+    def produce(vid):
+        mark = None if marks is None else marks.get(vid) or {}
+        return iter_video_pages(youtube, vid, limit, bucket, mark, walks)
+
+    return iter_pages(produce, video_ids, workers)